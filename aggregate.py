@@ -0,0 +1,149 @@
+import logging
+import math
+
+import numparse
+
+logger = logging.getLogger(__name__)
+
+# The columns with numbers in them
+NUMBER_COLUMNS = ["Antal", "Sats", "Beløb"]
+STOCK_COLUMNS = ["Employers_Matched_Contribution", "Additional_contribution", "Stocks_total"]
+
+
+def parse_numbers(values, codes=None, column: str = None):
+    """
+    Read a whole column of danish formatted numbers, like numparse.parse_column.
+    The plain numbers, which is almost every cell, are checked with the numparse pattern and converted by pandas
+    for the whole column at once. Only the rest, like 1.234,56- and cells that are not numbers, goes through numparse.
+    The cells that are not numbers are logged with their code, as they are most likely a column that was not
+    extracted correctly
+    :param values: Series of strings like 1.234,56
+    :param codes: Series of the Art of each row
+    :param column: the name of the column, for the log
+    :return: Series of floats, NaN where the cell is empty and 0.0 where it could not be parsed like get_float
+    """
+    import pandas as pd
+    numbers = pd.Series(math.nan, index=values.index, dtype=float)
+    plain = values.str.fullmatch(numparse.PATTERNS["dk"].pattern) & ~values.str[-1:].isin(list(numparse.MINUS))
+    # The same as numparse.TABLES["dk"], as replace is faster than translate on a Series
+    numbers[plain] = (values[plain].str.replace(".", "", regex=False).str.replace(",", ".", regex=False)
+                      .str.replace("−", "-", regex=False).astype(float))
+    rest = ~plain & (values != "")
+    if rest.any():
+        parsed, malformed = numparse.parse_column(values[rest].tolist(), None if codes is None else codes[rest].tolist(),
+                                                  column, malformed_value=0.0)
+        numbers[rest] = [math.nan if x is None else x for x in parsed]
+        rows = values.index[rest]
+        for cell in malformed:
+            logger.warning("%s of %s in row %s is not a number: %r", cell.column, cell.code, rows[cell.row], cell.text)
+    return numbers
+
+
+def to_table(parsed: dict):
+    """
+    Load all the parsed payslips into one table, with a row for each line item
+    :param parsed: dict of month to the columns returned by parser.parse
+    :return: DataFrame with the columns month, Art, Specifikation, Antal, Sats and Beløb
+    """
+    import pandas as pd
+    data = {"month": [], "Art": [], "Specifikation": [], "Antal": [], "Sats": [], "Beløb": []}
+    for month, columns in parsed.items():
+        data["month"].extend([month] * len(columns["Art"]))
+        for column in ("Art", "Specifikation", *NUMBER_COLUMNS):
+            data[column].extend(columns[column])
+    table = pd.DataFrame(data)
+    for column in NUMBER_COLUMNS:
+        table[column] = parse_numbers(table[column].astype(str), table["Art"], column)
+    logger.info("Loaded %s line items from %s payslips", len(table), len(parsed))
+    return table
+
+
+def stocks(table, months: list):
+    """
+    Calculate the stocks for each month
+    Employer matched (up to 2.5% of salary) is the Antal of 5092, and the additional stocks is Beløb of 9221
+    :param table: the table from to_table
+    :param months: all the months, so months without any stocks gets 0
+    :return: DataFrame indexed by month, with the Employers_Matched_Contribution, Additional_contribution
+     and Stocks_total columns
+    """
+    import pandas as pd
+    emp = table.loc[table["Art"] == "5092"].groupby("month")["Antal"].sum()
+    addit = table.loc[table["Art"] == "9221"].groupby("month")["Beløb"].sum()
+    result = pd.DataFrame({
+        "Employers_Matched_Contribution": emp.reindex(months, fill_value=0.0),
+        # Subtracted from 0, so a month without additional stocks is 0.0 and not -0.0
+        "Additional_contribution": 0.0 - addit.reindex(months, fill_value=0.0),
+    }, index=pd.Index(months, name="month"))
+    result["Stocks_total"] = result["Employers_Matched_Contribution"] + result["Additional_contribution"]
+    return result
+
+
+def stocks_only(parsed: dict) -> dict:
+    """
+    The same stocks as stocks and to_nested with simple, without the table, so pandas is not imported
+    when only the stocks are needed, eg. with --simple where every payslip is found in the cache
+    :param parsed: dict of month to the columns returned by parser.parse
+    :return: dict of month to its stocks
+    """
+    res = {}
+    for month, columns in parsed.items():
+        emp = _sum(columns, "5092", "Antal")
+        addit = 0.0 - _sum(columns, "9221", "Beløb")
+        res[month] = {"Employers_Matched_Contribution": emp, "Additional_contribution": addit,
+                      "Stocks_total": emp + addit}
+    return res
+
+
+def _sum(columns: dict, code: str, column: str) -> float:
+    """
+    The sum of the column of every line item with the code, where empty cells are skipped
+    and cells that are not numbers are 0.0, like parse_numbers
+    """
+    rows = [row for row, art in enumerate(columns["Art"]) if art == code]
+    if not rows:
+        return 0.0
+    numbers, malformed = numparse.parse_column([str(columns[column][row]) for row in rows], [code] * len(rows),
+                                               column, malformed_value=0.0)
+    for cell in malformed:
+        logger.warning("%s of %s in row %s is not a number: %r", cell.column, cell.code, rows[cell.row], cell.text)
+    return math.fsum(x for x in numbers if x is not None)
+
+
+def totals(table, by=("Art",)):
+    """
+    Sum Antal and Beløb grouped by the given columns, eg. ("month", "Art") for the total of each code per month
+    :param table: the table from to_table
+    :param by: the columns to group by
+    :return: DataFrame indexed by the groups, with the sum of Antal and Beløb and the number of rows
+    """
+    grouped = table.groupby(list(by), sort=True)
+    result = grouped[["Antal", "Beløb"]].sum()
+    result["rows"] = grouped.size()
+    return result
+
+
+def to_nested(table, stock_table, simple: bool = False) -> dict:
+    """
+    The result as the nested dict of month to code, which is what the writers in outtu expects
+    If a code is there more than once in a month, the last one is used
+    :param table: the table from to_table
+    :param stock_table: the table from stocks
+    :param simple: only add the stocks, and not every line item
+    :return: dict of month to the line items and stocks of that month
+    """
+    res = {month: {} for month in stock_table.index}
+    if not simple:
+        rows = zip(*(table[x].tolist() for x in ("month", "Art", "Specifikation", *NUMBER_COLUMNS)))
+        for month, art, s, a, sa, b in rows:
+            res[month][art] = {
+                "Specifikation": s if s else "",
+                "Beløb": None if math.isnan(b) else b,
+                "Antal": None if math.isnan(a) else a,
+                "Sats": None if math.isnan(sa) else sa,
+            }
+    for month, emp, addit, total in zip(stock_table.index, *(stock_table[x].tolist() for x in STOCK_COLUMNS)):
+        res[month]["Employers_Matched_Contribution"] = emp
+        res[month]["Additional_contribution"] = addit
+        res[month]["Stocks_total"] = total
+    return res
@@ -0,0 +1,189 @@
+import argparse
+import json
+import pathlib
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from collections import OrderedDict
+
+import aggregate
+import kodekatalog
+import numparse
+import synthetic
+from extraction import extractors, get_extractor
+from outtu import XML, out_functions
+from parser import PARSER_VERSION, align
+
+args = argparse.ArgumentParser("Compare the speed and output of the extraction engines")
+args.add_argument("-i", "--input", help="The directory with the pdfs", type=str, default="loenseddler")
+args.add_argument("-r", "--repeat", help="How many times to extract each pdf", type=int, default=3)
+args.add_argument("--synthetic", help="Instead of the pdfs in --input, time every stage on this many "
+                                      "generated payslips, eg. --synthetic 10 1000 10000", type=int, nargs="+")
+args.add_argument("--engines", help="The engines to time with --synthetic", nargs="+",
+                  choices=[x._get_name() for x in extractors], default=["text"])
+args.add_argument("--end-to-end", help="Also time a full run of main.py with --synthetic", action="store_true")
+args.add_argument("--results", help="Where to write the results of --synthetic as json", type=str,
+                  default="bench_results.json")
+args.add_argument("--numbers", help="Instead, time reading this many danish formatted numbers", type=int)
+
+
+def bench_engines(pdfs: list, repeat: int) -> dict:
+    """
+    Time every engine on every pdf, and check that they give the same columns as camelot
+    :param pdfs: the payslips
+    :param repeat: how many times each pdf is extracted, the fastest time is used
+    :return: for each engine the total time, and the pdfs that failed or differed from camelot
+    """
+    results = {}
+    reference = {}
+    for extractor in extractors:
+        engine = extractor()
+        result = {"seconds": 0.0, "failed": [], "different": []}
+        for pdf in pdfs:
+            best = None
+            for _ in range(repeat):
+                start = time.perf_counter()
+                try:
+                    columns = align(engine.extract(pdf, False)[0])
+                except Exception as e:
+                    result["failed"].append("{}: {}".format(pdf.name, e))
+                    break
+                elapsed = time.perf_counter() - start
+                best = elapsed if best is None else min(best, elapsed)
+            else:
+                result["seconds"] += best
+                if engine.name == "camelot":
+                    reference[pdf] = columns
+                elif reference.get(pdf) != columns:
+                    result["different"].append(pdf.name)
+        results[engine.name] = result
+    return results
+
+
+def timed(results: dict, stage: str, amount: int, function):
+    """
+    Run function and add how long it took to results
+    :return: what function returned
+    """
+    start = time.perf_counter()
+    value = function()
+    elapsed = time.perf_counter() - start
+    results[stage] = {"seconds": elapsed, "per_document": elapsed / amount if amount else 0.0}
+    return value
+
+
+def bench_synthetic(amount: int, engines: list, directory: pathlib.Path, end_to_end: bool = False) -> dict:
+    """
+    Time extraction, alignment, aggregation and every output format on amount generated payslips
+    :return: dict of stage to the time it took
+    """
+    results = {}
+    expected = timed(results, "generate", amount, lambda: synthetic.generate(directory / "pdfs", amount))
+
+    for name in engines:
+        engine = get_extractor(name)
+        extracted = timed(results, "extract_" + name, amount, lambda: [engine.extract(x, False)[0] for x in expected])
+        results["extract_" + name]["different"] = sum(a != b for a, (_, b) in zip(extracted, expected.values()))
+
+    parsed = timed(results, "align", amount, lambda: {month: align(x) for month, x in expected.values()})
+
+    def aggregate_all():
+        table = aggregate.to_table(parsed)
+        return aggregate.to_nested(table, aggregate.stocks(table, list(parsed)))
+    nested = OrderedDict(timed(results, "aggregate", amount, aggregate_all))
+
+    for out in out_functions:
+        if out is XML:
+            continue
+        filename = directory / ("output." + out._get_name())
+        timed(results, "write_" + out._get_name(), amount, lambda: out("dk").save(nested, str(filename)))
+
+    if end_to_end:
+        command = [sys.executable, str(pathlib.Path(__file__).parent / "main.py"), "-i", str(directory / "pdfs"),
+                   "-o", str(directory / "main"), "-f", "JSON", "-e", engines[0], "--no-cache"]
+        timed(results, "main_" + engines[0], amount, lambda: subprocess.run(command, check=True))
+    return results
+
+
+def bench_numbers(amount: int) -> dict:
+    """
+    Time numparse against the str.replace and float() that util_functions.get_float used to do on every cell,
+    and aggregate.parse_numbers on the same cells as a Series
+    :return: dict of the way the numbers are read to the time it took
+    """
+    rng = random.Random(0)
+    cells = [synthetic.dk(rng.uniform(-20000, 40000)) if rng.random() < 0.8 else "" for _ in range(amount)]
+
+    def replace_float(s: str) -> float:
+        try:
+            return float(s.replace(".", "").replace(",", "."))
+        except ValueError:
+            return 0.0
+
+    results = {}
+    timed(results, "replace_float", amount, lambda: [replace_float(x) for x in cells])
+    timed(results, "parse", amount, lambda: [numparse.parse(x) for x in cells])
+    timed(results, "parse_column", amount, lambda: numparse.parse_column(cells))
+    timed(results, "parse_column_exact", amount, lambda: numparse.parse_column(cells, exact=True))
+    import pandas as pd
+    series = pd.Series(cells)
+    timed(results, "parse_numbers", amount, lambda: aggregate.parse_numbers(series))
+    return results
+
+
+def run_synthetic(argz):
+    report = {
+        "parser_version": PARSER_VERSION,
+        "katalog_version": kodekatalog.VERSION,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "sizes": {},
+    }
+    try:
+        report["revision"] = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                                            cwd=pathlib.Path(__file__).parent).stdout.strip()
+    except OSError:
+        pass
+    for amount in argz.synthetic:
+        with tempfile.TemporaryDirectory() as directory:
+            results = bench_synthetic(amount, argz.engines, pathlib.Path(directory), argz.end_to_end)
+        report["sizes"][str(amount)] = results
+        print("{} documents".format(amount))
+        for stage, result in results.items():
+            print("  {:<16} {:>10.3f} s {:>10.3f} ms/doc".format(stage, result["seconds"],
+                                                               result["per_document"] * 1000))
+    with open(argz.results, 'w') as f:
+        json.dump(report, f, indent=2)
+    print("Results written to {}".format(argz.results))
+
+
+def main():
+    argz = args.parse_args()
+    if argz.numbers:
+        for name, result in bench_numbers(argz.numbers).items():
+            print("{:<20} {:>10.3f} s {:>10.3f} us/number".format(name, result["seconds"],
+                                                                 result["per_document"] * 1000000))
+        return
+    if argz.synthetic:
+        run_synthetic(argz)
+        return
+    pdfs = sorted(x for x in pathlib.Path(argz.input).glob("*") if x.name.lower().endswith("pdf"))
+    if not pdfs:
+        raise Exception("No pdfs found in {}".format(argz.input))
+    results = bench_engines(pdfs, argz.repeat)
+    print("{:<10} {:>10} {:>10} {:>8} {:>10}".format("engine", "total s", "per pdf s", "failed", "different"))
+    for name, result in results.items():
+        print("{:<10} {:>10.3f} {:>10.3f} {:>8} {:>10}".format(
+            name, result["seconds"], result["seconds"] / len(pdfs), len(result["failed"]), len(result["different"])))
+        for line in result["failed"]:
+            print("  failed: {}".format(line))
+        for line in result["different"]:
+            print("  different from camelot: {}".format(line))
+
+
+if __name__ == '__main__':
+    main()
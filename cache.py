@@ -0,0 +1,131 @@
+import hashlib
+import json
+import logging
+import os
+import pathlib
+import time
+
+import kodekatalog
+from parser import PARSER_VERSION
+
+logger = logging.getLogger(__name__)
+
+
+def _update(h, pdf: pathlib.Path):
+    with open(pdf, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 16), b""):
+            h.update(chunk)
+
+
+def file_hash(pdf: pathlib.Path) -> str:
+    """
+    :param pdf: the payslip
+    :return: hex digest of the content of the pdf
+    """
+    h = hashlib.sha256()
+    _update(h, pdf)
+    return h.hexdigest()
+
+
+def versioned_key(h, katalog_version: str = kodekatalog.VERSION, engine: str = "camelot", layouts: dict = None) -> str:
+    """
+    Finish the hash of a pdf with the versions of the kodekatalog and the parser, the engine and the layouts,
+    as they all change what it is parsed to
+    :param h: sha256 of the content of the pdf
+    :param layouts: the layouts given to the engine, None for the built in ones
+    :return: hex digest used as the key of the parsed pdf
+    """
+    h.update(katalog_version.encode())
+    h.update(PARSER_VERSION.encode())
+    h.update(engine.encode())
+    if layouts is not None:
+        h.update(json.dumps(layouts, sort_keys=True).encode())
+    return h.hexdigest()
+
+
+class ParseCache:
+    """
+    On disk cache of parsed payslips.
+    The columns returned by parse are stored as json, keyed by the hash of the pdf together with
+    the version of the kodekatalog and the parser, the engine and the layouts. Changing any of them makes
+    the old entries miss, and they will eventually be evicted.
+    """
+
+    def __init__(self, directory: pathlib.Path, max_size: int = None, max_age: float = None,
+                 katalog_version: str = kodekatalog.VERSION, engine: str = "camelot", layouts: dict = None):
+        """
+        :param directory: where to store the cache
+        :param max_size: max size of the cache in bytes, None for no limit
+        :param max_age: max age in seconds of an entry since it was last used, None for no limit
+        :param katalog_version: version of the kodekatalog the payslips are parsed with
+        :param engine: name of the extractor the payslips are parsed with
+        :param layouts: the layouts given to the extractor, None for the built in ones
+        """
+        self.directory = pathlib.Path(directory)
+        self.max_size = max_size
+        self.max_age = max_age
+        self.katalog_version = katalog_version
+        self.engine = engine
+        self.layouts = layouts
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    def key(self, pdf: pathlib.Path) -> str:
+        """
+        Get the cache key of a pdf
+        :param pdf: the payslip
+        :return: hex digest of the content, kodekatalog version, parser version, engine and layouts
+        """
+        h = hashlib.sha256()
+        _update(h, pdf)
+        return versioned_key(h, self.katalog_version, self.engine, self.layouts)
+
+    def _path(self, key: str) -> pathlib.Path:
+        return self.directory / key[:2] / (key + ".json")
+
+    def get(self, key: str):
+        """
+        :param key: the key from ParseCache.key
+        :return: the cached columns, or None if it is not in the cache
+        """
+        path = self._path(key)
+        try:
+            with open(path) as f:
+                columns = json.load(f)
+        except (OSError, ValueError):
+            return None
+        # Touch the entry, so the eviction sees it as recently used
+        os.utime(path)
+        return columns
+
+    def put(self, key: str, columns: dict):
+        path = self._path(key)
+        path.parent.mkdir(exist_ok=True)
+        # Write to a temporary file first, so a crash never leaves a half written entry behind
+        tmp = path.with_suffix(".tmp")
+        with open(tmp, 'w') as f:
+            json.dump(columns, f)
+        os.replace(tmp, path)
+
+    def evict(self):
+        """
+        Remove entries that are older than max_age, and then the least recently used until
+        the cache is smaller than max_size
+        """
+        now = time.time()
+        entries = []
+        for path in self.directory.glob("*/*.json"):
+            stat = path.stat()
+            if self.max_age is not None and now - stat.st_mtime > self.max_age:
+                logger.info("Evicting %s, as it is too old", path.name)
+                path.unlink()
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        if self.max_size is None:
+            return
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_size:
+                break
+            logger.info("Evicting %s, as the cache is too big", path.name)
+            path.unlink()
+            total -= size
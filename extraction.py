@@ -0,0 +1,318 @@
+import json
+import logging
+import pathlib
+import re
+from abc import ABC
+
+from util_functions import find_month
+
+logger = logging.getLogger(__name__)
+
+# The columns of the line item table, in the order they are on the payslip
+COLUMNS = ["Art", "Specifikation", "Antal", "Sats", "Beløb"]
+
+# Where the line item table is, for each version of the payslip layout. The pages are given like camelot expects,
+# and the table area is "x1,y1,x2,y2" in points, from the top left to the bottom right corner of the table,
+# measured from the bottom left of the page.
+# It is empty until the area is measured on a real payslip, eg. from camelot.plot(tables[0], kind="contour"),
+# as an area that is not measured is not faster than looking on the whole page.
+# Until then the layouts are given with a json file in the same format, see load_layouts
+LAYOUTS = {}
+
+
+def load_layouts(filename: str = None) -> dict:
+    """
+    Load the layouts, with the ones from a json file added to or replacing the ones in LAYOUTS
+    :param filename: json file with extra layouts, or None to only use LAYOUTS
+    :return: dict of layout name to its pages and table_areas
+    """
+    layouts = dict(LAYOUTS)
+    if filename:
+        with open(filename, encoding="utf-8") as f:
+            layouts.update(json.load(f))
+    return layouts
+
+
+def _first_page(file: pathlib.Path):
+    """
+    Read the layout of the first page and the metadata of the pdf with pdfminer
+    :return: the LTPage of the first page, and the title, subject and keywords of the pdf
+    """
+    from pdfminer.converter import PDFPageAggregator
+    from pdfminer.layout import LAParams
+    from pdfminer.pdfdocument import PDFDocument
+    from pdfminer.pdfinterp import PDFPageInterpreter, PDFResourceManager
+    from pdfminer.pdfpage import PDFPage
+    from pdfminer.pdfparser import PDFParser
+    # The document is opened once, for both the metadata and the layout of the first page
+    with open(file, 'rb') as f:
+        document = PDFDocument(PDFParser(f))
+        first = next(PDFPage.create_pages(document), None)
+        if first is None:
+            raise Exception("{} has no pages".format(file.name))
+        manager = PDFResourceManager()
+        device = PDFPageAggregator(manager, laparams=LAParams())
+        PDFPageInterpreter(manager, device).process_page(first)
+        return device.get_result(), _metadata(document)
+
+
+def _metadata(document) -> str:
+    """
+    The title, subject and keywords of the pdf
+    """
+    from pdfminer.pdftypes import resolve1
+    from pdfminer.utils import decode_text
+    values = []
+    for info in document.info:
+        for field in ("Title", "Subject", "Keywords"):
+            value = resolve1(info.get(field))
+            if isinstance(value, bytes):
+                values.append(decode_text(value))
+            elif isinstance(value, str):
+                values.append(value)
+    return "\n".join(values)
+
+
+def _page_text(page) -> str:
+    from pdfminer.layout import LTTextContainer
+    return "".join(x.get_text() for x in page if isinstance(x, LTTextContainer))
+
+
+class ExtractorBase(ABC):
+    """
+    Gets the raw text of the line item table out of a payslip, and the month of the payslip if it can be found
+    while the pdf is read anyway.
+    The cells are one string per column, with a line for each value in the column, which is what parse
+    expects to align.
+    """
+    name = None
+    # The layout the table was found with by the last extract, eg. the name of the layout in LAYOUTS
+    layout = None
+
+    def __init__(self, layouts: dict = None):
+        """
+        :param layouts: where the table is for each layout, LAYOUTS if None. Only used by the extractors that can
+         be told where the table is
+        """
+        self.name = self._get_name()
+        self.layouts = LAYOUTS if layouts is None else layouts
+
+    def extract(self, file: pathlib.Path, with_month: bool = True) -> (list, str):
+        """
+        :param with_month: also look for the month, which is only needed when it is not in the filename.
+         The extractors that has to read the pdf again to find it, skips it when this is False
+        :return: the cells, and the month formatted as YYYY-MM or None
+        """
+        raise NotImplementedError("This needs to be implemented.")
+
+    def warm_up(self):
+        """
+        Import what extract needs, so the first pdf does not have to wait for it
+        """
+        pass
+
+    def __str__(self):
+        return self._get_name()
+
+    @staticmethod
+    def _get_name():
+        raise NotImplementedError("This needs to be implemented.")
+
+
+class Camelot(ExtractorBase):
+    """
+    Finds the table with camelots lattice parser. It is slow, but it finds the table by its ruling lines,
+    so it does not care where on the page the table is.
+    The table is first only looked for on the page and in the area of each of the layouts, so camelot does not
+    build every table on the page. If none of them gives a valid table, every table on the page is detected.
+    Without any layouts only the full detection is done.
+    """
+
+    @staticmethod
+    def _trim(table):
+        """
+        Camelot uses the edges of the table area as ruling lines, which gives empty rows and columns around the table
+        :return: the table without the rows and columns that are all empty
+        """
+        filled = table != ""
+        return table.loc[filled.any(axis=1), filled.any(axis=0)]
+
+    @staticmethod
+    def _valid(table) -> bool:
+        """
+        Check that the table looks like the line item table, with the headers, a row of values
+        and only codes in Art
+        """
+        if table.shape[0] < 2 or table.shape[1] != len(COLUMNS):
+            return False
+        return re.fullmatch(r"\d+(\n\d+)*", table.iloc[1, 0].strip()) is not None
+
+    def warm_up(self):
+        import camelot  # noqa: F401
+
+    def extract(self, file: pathlib.Path, with_month: bool = True) -> (list, str):
+        # Imported here, as camelot pulls in pandas, numpy and opencv which takes seconds to load
+        import camelot
+        filename = file.absolute().__str__()
+        for name, layout in self.layouts.items():
+            tables = camelot.read_pdf(filename, pages=layout.get("pages", "1"),
+                                      table_areas=layout.get("table_areas"))
+            table = self._trim(tables[0].df) if len(tables) else None
+            if table is not None and self._valid(table):
+                logger.info("Found the table of %s with the %s layout", file.name, name)
+                self.layout = name
+                # The header of the payslip is not in the area, so the month is found in the text of the page
+                month = find_month("\n".join(table.values.ravel().tolist()))
+                if month is None and with_month:
+                    page, metadata = _first_page(file)
+                    month = find_month(_page_text(page)) or find_month(metadata)
+                return table.iloc[1].tolist(), month
+            logger.info("The table of %s is not where the %s layout has it", file.name, name)
+
+        self.layout = "page"
+        tables = camelot.read_pdf(filename)
+        if len(tables) == 0:
+            raise Exception("Camelot did not find any tables in {}".format(file.name))
+        # There is 2 tables. But we are only interested in the first one, and the row below the headers
+        table = tables[0].df
+        # Camelot does not give the text outside of the tables, so the month is looked for in the tables
+        month = find_month("\n".join(cell for t in tables for row in t.df.values.tolist() for cell in row))
+        if month is None and with_month:
+            page, metadata = _first_page(file)
+            month = find_month(_page_text(page)) or find_month(metadata)
+        return [table[i][1] for i in range(len(COLUMNS))], month
+
+    @staticmethod
+    def _get_name():
+        return "camelot"
+
+
+class Text(ExtractorBase):
+    """
+    Reads the table directly from the text layer with pdfminer.
+    Every character is put in a column by where it is on the page, so this skips the image processing
+    and the DataFrame camelot builds. It only works as long as the payslips use the same layout.
+    """
+    # The x range in points of each column on the page
+    column_ranges = {
+        "Art": (0, 75),
+        "Specifikation": (75, 300),
+        "Antal": (300, 385),
+        "Sats": (385, 470),
+        "Beløb": (470, 1000),
+    }
+
+    def _column(self, x: float):
+        for column, (x0, x1) in self.column_ranges.items():
+            if x0 <= x < x1:
+                return column
+        return None
+
+    def warm_up(self):
+        import pdfminer.converter  # noqa: F401
+        import pdfminer.pdfinterp  # noqa: F401
+
+    def extract(self, file: pathlib.Path, with_month: bool = True) -> (list, str):
+        from pdfminer.layout import LTChar, LTCurve, LTTextContainer, LTTextLine
+        self.layout = "page"
+        page, metadata = _first_page(file)
+        lines = []
+        rules = []
+        for element in page:
+            if isinstance(element, LTTextContainer):
+                lines.extend(x for x in element if isinstance(x, LTTextLine))
+            elif isinstance(element, LTCurve) and element.height < 2:
+                # Lines and thin rectangles are the ruling lines of the table
+                rules.append(element.y0)
+
+        headers = [x for x in lines if x.get_text().strip() == "Art" and self._column(x.x0) == "Art"]
+        if not headers:
+            raise Exception("Could not find the header of the table in {}".format(file.name))
+        header = max(headers, key=lambda x: x.y1)
+        # The values are in the row between the first two ruling lines below the header
+        below = sorted((y for y in rules if y < header.y0), reverse=True)
+        top = below[0] if below else header.y0
+        bottom = below[1] if len(below) > 1 else float("-inf")
+
+        cells = {column: [] for column in COLUMNS}
+        for line in sorted(lines, key=lambda x: -x.y1):
+            if not (bottom < (line.y0 + line.y1) / 2 < top):
+                continue
+            # A text line can span several columns, so split it on the position of each character
+            parts = {}
+            column = None
+            for char in line:
+                if isinstance(char, LTChar):
+                    column = self._column((char.x0 + char.x1) / 2)
+                if column is not None:
+                    parts[column] = parts.get(column, "") + char.get_text()
+            for column, text in parts.items():
+                cells[column].append(text.strip())
+        # The header of the payslip is found before the metadata, as the metadata could be from a template
+        month = find_month("\n".join(x.get_text() for x in lines)) or find_month(metadata)
+        return ["\n".join(cells[column]) for column in COLUMNS], month
+
+    @staticmethod
+    def _get_name():
+        return "text"
+
+
+class CamelotStream(Camelot):
+    """
+    Finds the table with camelots stream parser, which uses the space between the columns instead of the ruling lines.
+    Each line of text is a row, so the lines below the header are joined in to a cell for each column, like the
+    lattice parser gives them. Used when the table from the other extractors can not be aligned.
+    """
+
+    def extract(self, file: pathlib.Path, with_month: bool = True) -> (list, str):
+        import camelot
+        tables = camelot.read_pdf(file.absolute().__str__(), flavor="stream")
+        self.layout = "page"
+        for table in (x.df for x in tables):
+            header = [i for i, row in enumerate(table.values.tolist()) if row[0].strip() == "Art"]
+            if not header:
+                continue
+            # A column of the text can be split in to more columns by camelot, they belong to the column to the left
+            names = []
+            for cell in table.iloc[header[0]].tolist():
+                names.append(cell.strip() if cell.strip() in COLUMNS else names[-1] if names else COLUMNS[0])
+            cells = {column: [] for column in COLUMNS}
+            for row in table.iloc[header[0] + 1:].values.tolist():
+                parts = {}
+                for name, cell in zip(names, row):
+                    if cell.strip():
+                        parts[name] = parts.get(name, []) + [cell.strip()]
+                for name, values in parts.items():
+                    cells[name].append(" ".join(values))
+            month = None
+            if with_month:
+                page, metadata = _first_page(file)
+                month = find_month(_page_text(page)) or find_month(metadata)
+            return ["\n".join(cells[column]) for column in COLUMNS], month
+        raise Exception("Camelot stream did not find the line item table in {}".format(file.name))
+
+    @staticmethod
+    def _get_name():
+        return "camelot_stream"
+
+
+# Used when another extractor fails, as it is the one the parser was written against
+fallback = Camelot
+# Used when the table from the other extractors can not be aligned, as it finds the table in a different way
+second_pass = CamelotStream
+extractors: [ExtractorBase] = [Camelot, Text, CamelotStream]
+
+
+def get_extractor(name: str, layouts: dict = None) -> ExtractorBase:
+    for extractor in extractors:
+        if extractor._get_name() == name:
+            return extractor(layouts)
+    raise Exception("Unknown engine {}".format(name))
+
+
+def warm_up(name: str):
+    """
+    Import what the engine needs. Used as the initializer of the pool, so the processes are ready before
+    the first pdf arrives
+    """
+    get_extractor(name).warm_up()
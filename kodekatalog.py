@@ -1,3 +1,6 @@
+import hashlib
+import json
+
 # List of all codes used in the lønseddel
 
 # Spec = Kort navn af koden
@@ -9,6 +12,12 @@
 # spec_amount = Navnet + evt. ekstra "semi-kolonner" der er under kolonnen Specifikation
 # Eg. 842 : Orlov u/løn og feriedage har ud over navnet 2 ekstra kolonner hvilket giver 3
 
+# hooks = Specialtilfælde som parseren skal køre for koden
+# skat_af = beløb kan mangle hvis der ikke er nogen indkomst (8906)
+# manglende_traek = beløb kan mangle hvis der er manglende træk, 9990, på lønsedlen (9993)
+# sats_first_only = kun den første række med koden har en sats (8720, 8721)
+# not_in_total = beløb er kun til information, og tælles ikke med når det tjekkes at beløbene giver 9993 (9631, 9637, 9655)
+
 kode = {
     '1173': {'spec': 'Fri Telefon', 'hasAntal': True, 'hasSats': False, 'hasBeløb': False, 'spec_amount': 1},
     '2001': {'spec': 'Timer', 'hasAntal': True, 'hasSats': True, 'hasBeløb': True, 'spec_amount': 1},
@@ -17,11 +26,13 @@ kode = {
     '8716': {'spec': 'Ulykkesforsikring', 'hasAntal': True, 'hasSats': False, 'hasBeløb': False, 'spec_amount': 1},
     '8750': {'spec': 'ATP bidrag', 'hasAntal': True, 'hasSats': False, 'hasBeløb': True, 'spec_amount': 1},
     '8861': {'spec': 'Arbejdsmarkedbidrag', 'hasAntal': False, 'hasSats': True, 'hasBeløb': True, 'spec_amount': 2},
-    '8906': {'spec': 'A-indk', 'hasAntal': False, 'hasSats': True, 'hasBeløb': True, 'spec_amount': 3},
+    '8906': {'spec': 'A-indk', 'hasAntal': False, 'hasSats': True, 'hasBeløb': True, 'spec_amount': 3,
+             'hooks': ['skat_af']},
     '9220': {'spec': 'Contribution', 'hasAntal': True, 'hasSats': True, 'hasBeløb': True, 'spec_amount': 1},
     '9414': {'spec': 'Aktivitetsforening', 'hasAntal': False, 'hasSats': False, 'hasBeløb': True, 'spec_amount': 1},
     '9463': {'spec': 'Kantine', 'hasAntal': False, 'hasSats': False, 'hasBeløb': True, 'spec_amount': 1},
-    '9993': {'spec': 'Overført til konto', 'hasAntal': False, 'hasSats': False, 'hasBeløb': True, 'spec_amount': 1},
+    '9993': {'spec': 'Overført til konto', 'hasAntal': False, 'hasSats': False, 'hasBeløb': True, 'spec_amount': 1,
+             'hooks': ['manglende_traek']},
     '9761': {'spec': 'Afregnet feriepenge ferieår 2. del', 'hasAntal': True, 'hasSats': False, 'hasBeløb': True,
              'spec_amount': 1},
     '9762': {'spec': 'Arbejdsmarkedsbidrag ferie ferieår 2. del', 'hasAntal': False, 'hasSats': False, 'hasBeløb': True,
@@ -45,11 +56,12 @@ kode = {
     '5090': {'spec': 'Værdi af arbejdsgiverbetalt sundhedsforsikring', 'hasAntal': True, 'hasSats': False,
              'hasBeløb': False, 'spec_amount': 1},
     '8720': {'spec': 'Firmapensionsbidrag egen andel', 'hasAntal': False, 'hasSats': True, 'hasBeløb': True,
-             'spec_amount': 1},
+             'spec_amount': 1, 'hooks': ['sats_first_only']},
     '9206': {'spec': 'Kilometergodtgørelse', 'hasAntal': True, 'hasSats': True, 'hasBeløb': True, 'spec_amount': 1},
     '9405': {'spec': 'Udbetalt via rejseafregning', 'hasAntal': False, 'hasSats': False, 'hasBeløb': True,
              'spec_amount': 1},
-    '8721': {'spec': 'Firmapension firmaandel', 'hasAntal': False, 'hasSats': True, 'hasBeløb': True, 'spec_amount': 1},
+    '8721': {'spec': 'Firmapension firmaandel', 'hasAntal': False, 'hasSats': True, 'hasBeløb': True, 'spec_amount': 1,
+             'hooks': ['sats_first_only']},
     '9221': {'spec': 'Additional contribution', 'hasAntal': True, 'hasSats': True, 'hasBeløb': True, 'spec_amount': 1},
     '842': {'spec': 'Orlov u/løn og feriedage', 'hasAntal': True, 'hasSats': False, 'hasBeløb': False,
             'spec_amount': 3},
@@ -62,11 +74,14 @@ kode = {
     '3010': {'spec': 'Refferal bonus', 'hasAntal': False, 'hasSats': False, 'hasBeløb': False, 'spec_amount': 1},
     '8632': {'spec': 'Feriefri - Ny Saldo - udbetaling/træk', 'hasAntal': True, 'hasSats': True, 'hasBeløb': True, 'spec_amount': 1},
     '8676': {'spec': 'Fritvalg, Udbetaling.', 'hasAntal': False, 'hasSats': False, 'hasBeløb': True, 'spec_amount': 1},
-    '9631': {'spec': 'Feriepenge optjent sidste år', 'hasAntal': True, 'hasSats': False, 'hasBeløb': True, 'spec_amount': 1},
-    '9637': {'spec': 'Feriepenge i alt sidste år', 'hasAntal': False, 'hasSats': False, 'hasBeløb': True, 'spec_amount': 1},
+    '9631': {'spec': 'Feriepenge optjent sidste år', 'hasAntal': True, 'hasSats': False, 'hasBeløb': True, 'spec_amount': 1,
+             'hooks': ['not_in_total']},
+    '9637': {'spec': 'Feriepenge i alt sidste år', 'hasAntal': False, 'hasSats': False, 'hasBeløb': True, 'spec_amount': 1,
+             'hooks': ['not_in_total']},
     '9638': {'spec': 'Arbejdsmarkedsbidrag Feriepenge i alt sidste år', 'hasAntal': False, 'hasSats': False, 'hasBeløb': True, 'spec_amount': 1},
     '9646': {'spec': 'A-indk Feriepenge i alt sidste år', 'hasAntal': False, 'hasSats': True, 'hasBeløb': True, 'spec_amount': 3},
-    '9655': {'spec': 'Feriepenge netto sidste år til feriekonto', 'hasAntal': True, 'hasSats': False, 'hasBeløb': True, 'spec_amount': 1},
+    '9655': {'spec': 'Feriepenge netto sidste år til feriekonto', 'hasAntal': True, 'hasSats': False, 'hasBeløb': True, 'spec_amount': 1,
+             'hooks': ['not_in_total']},
     '9800': {'spec': 'Afregnet feriepenge - overgangsperiode', 'hasAntal': True, 'hasSats': False, 'hasBeløb': True, 'spec_amount': 1},
     '9801': {'spec': 'Afregnet feriepenge - overgangsperiode Arbejdsmarkedsbidrag', 'hasAntal': False, 'hasSats': False, 'hasBeløb': True, 'spec_amount': 1},
     '9805': {'spec': 'Afregnet feriepenge - overgangsperiode A-indk', 'hasAntal': False, 'hasSats': True, 'hasBeløb': True, 'spec_amount': 3},
@@ -77,3 +92,93 @@ kode = {
     '8606': {'spec': 'Afregning feriefri gl. saldo', 'hasAntal': True, 'hasSats': True, 'hasBeløb': True, 'spec_amount': 1},
 
 }
+
+
+class UnknownCodes(Exception):
+    """
+    Raised with every code of a payslip that is not in the kodekatalog, so they can all be added at once
+    """
+
+    def __init__(self, codes: list):
+        super().__init__(codes)
+        self.codes = codes
+
+    def __str__(self):
+        return "Koder {} ikke fundet i kodekatalog.".format(", ".join(self.codes))
+
+
+class Kode:
+    """
+    A code of the kodekatalog, compiled so the parser does not have to look up each field for every row
+    """
+    __slots__ = ("code", "spec", "spec_amount", "has_antal", "has_sats", "has_beloeb", "mask", "hooks")
+
+    def __init__(self, code: str, spec: str, spec_amount: int, has_antal: bool, has_sats: bool, has_beloeb: bool,
+                 hooks: tuple):
+        self.code = code
+        self.spec = spec
+        self.spec_amount = spec_amount
+        self.has_antal = has_antal
+        self.has_sats = has_sats
+        self.has_beloeb = has_beloeb
+        # Which of Antal, Sats and Beløb the code has a value in
+        self.mask = (has_antal, has_sats, has_beloeb)
+        self.hooks = hooks
+
+
+class Katalog:
+    """
+    The compiled kodekatalog
+    """
+    __slots__ = ("codes", "version")
+
+    def __init__(self, codes: dict, version: str):
+        self.codes = codes
+        self.version = version
+
+    def __contains__(self, code: str) -> bool:
+        return code in self.codes
+
+    def __getitem__(self, code: str) -> Kode:
+        return self.codes[code]
+
+    def missing(self, codes) -> list:
+        """
+        :param codes: the codes of a payslip
+        :return: the codes that are not in the kodekatalog, sorted
+        """
+        return sorted(set(codes).difference(self.codes))
+
+
+def compile_katalog(data: dict) -> Katalog:
+    """
+    Compile the codes from the same format as kode
+    :param data: dict of code to its fields
+    :return: the compiled kodekatalog
+    """
+    codes = {
+        code: Kode(code, ko.get("spec", ""), ko.get("spec_amount", 1), ko.get("hasAntal", False),
+                   ko.get("hasSats", False), ko.get("hasBeløb", False), tuple(ko.get("hooks", ())))
+        for code, ko in data.items()
+    }
+    # Used to invalidate cached payslips when a code is added or changed
+    version = hashlib.sha256(json.dumps(data, sort_keys=True).encode()).hexdigest()[:16]
+    return Katalog(codes, version)
+
+
+def load(filename: str = None) -> Katalog:
+    """
+    Load the kodekatalog, with the codes from a json file added to or replacing the ones in kode.
+    The file uses the same format as kode, so new codes can be added without changing the code
+    :param filename: json file with extra codes, or None to only use kode
+    :return: the compiled kodekatalog
+    """
+    data = dict(kode)
+    if filename:
+        with open(filename, encoding="utf-8") as f:
+            data.update(json.load(f))
+    return compile_katalog(data)
+
+
+KATALOG = load()
+VERSION = KATALOG.version
@@ -1,13 +1,41 @@
+import time
+
+# Taken before the other imports, so --profile-startup can show how long they took
+STARTED = time.perf_counter()
+
 import argparse
+import heapq
+import json
 import logging
+import os
 import pathlib
 import re
+import sys
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 
+import aggregate
+import kodekatalog
+from cache import ParseCache, file_hash
+from extraction import extractors, load_layouts, warm_up
+from metrics import Metrics
 from outtu import *
 from parser import parse
-from util_functions import get_float, get_month
+from reconcile import Strategies
+from store import Store
+from util_functions import get_month
+from watch import batches, get_watcher, watchers
 
 logger = logging.getLogger(__name__)
+MONTH_REGEX = r"Lønseddel - loenseddel([a-z]+)(\d{4}).*.PDF"
+# How many pdfs each process has queued ahead of the month being written
+WINDOW_PER_JOB = 4
+# How many months are aggregated together
+CHUNK_SIZE = 64
+# How many times a new pool is started in a run, when a process in the pool dies
+POOL_RESTARTS = 2
+
 args = argparse.ArgumentParser("Get all information from sallery pdfs")
 args.add_argument("-i", "--input", help="The root directory of the pdfs", type=str, default=".")
 args.add_argument("-o", "--output", help="The output file", type=str, default="output")
@@ -18,7 +46,47 @@ args.add_argument("-s", "--simple", help="Only output the stocks", action="store
 args.add_argument("-v", "--verbose", help="Verbose output", choices=["info", "INFO", "WARNING", "ERROR", "CRITICAL"],
                   default="ERROR")
 args.add_argument("-n", "--number_format", help="The number format", choices=["dk", "en"], default="dk")
+args.add_argument("-j", "--jobs", help="Number of pdfs to parse in parallel", type=int, default=os.cpu_count() or 1)
+args.add_argument("--cache-dir", help="Where to cache parsed pdfs", type=str,
+                  default=str(pathlib.Path.home() / ".cache" / "paycheckparser"))
+args.add_argument("--no-cache", help="Do not read or write the cache", action="store_true")
+args.add_argument("--cache-max-size", help="Max size of the cache in MB", type=float, default=100)
+args.add_argument("--cache-max-age", help="Remove cached pdfs not used for this many days", type=float, default=365)
+args.add_argument("-e", "--engine", help="How to read the table in the pdfs, camelot is used if the engine fails",
+                  choices=[x._get_name() for x in extractors], default="camelot")
+args.add_argument("-k", "--kodekatalog", help="Json file with codes to add to or replace in the kodekatalog", type=str)
+args.add_argument("--layouts", help="Json file with the page and area of the table for each payslip layout, "
+                                    "so camelot only has to look there instead of on the whole page", type=str)
+args.add_argument("--incremental", help="Only parse pdfs for months not already in the JSON, JSONL or Pickle output",
+                  action="store_true")
+args.add_argument("-b", "--batch", help="Look for pdfs in a folder for each employee, recursively", action="store_true")
+args.add_argument("--combined", help="With --batch, write all employees to the same output instead of one each",
+                  action="store_true")
+args.add_argument("--on-duplicate", help="What to do when an employee has different pdfs for the same month, "
+                                         "newest uses the most recently modified, as that is the corrected one",
+                  choices=["newest", "error"], default="newest")
+args.add_argument("--non-interactive", help="Do not ask for the month of pdfs where it can not be found, "
+                                            "but write them to --unresolved-report", action="store_true")
+args.add_argument("--unresolved-report", help="Where --non-interactive writes the pdfs without a month",
+                  type=str, default="unresolved.json")
+args.add_argument("--profile-startup", help="Print how long it took to import and parse the arguments",
+                  action="store_true")
+args.add_argument("--metrics", help="Write how long each stage took for each pdf, and counters like cache hits, "
+                                    "as json to this file", type=str)
+args.add_argument("-w", "--watch", help="Keep running, and update the outputs when pdfs are added to or changed in "
+                                        "the input. Implies --non-interactive", action="store_true")
+args.add_argument("--watcher", help="How to notice changes with --watch, the first that works is used by default. "
+                                    "Use polling for network drives", choices=[x._get_name() for x in watchers])
+args.add_argument("--poll-interval", help="Seconds between looking for changes with the polling watcher",
+                  type=float, default=2.0)
+args.add_argument("--db", help="Also store every line item in this sqlite database, "
+                               "which can be queried with store.py", type=str)
+args.add_argument("--profile", help="Write a cProfile dump of the run to this file. The pdfs parsed in the pool are "
+                                    "not included, so use it with --jobs 1", type=str)
 argz = args.parse_args()
+if argz.watch:
+    # Nobody is there to answer when running in the background
+    argz.non_interactive = True
 
 log = logging.getLogger()
 logging.getLogger()
@@ -33,76 +101,506 @@ ch.setFormatter(formatter)
 # add the handlers to the logger
 log.addHandler(ch)
 
+if argz.profile_startup:
+    heavy = [x for x in ("camelot", "pandas", "numpy", "cv2", "pdfminer") if x in sys.modules]
+    print("Startup took {:.1f} ms, heavy modules loaded: {}".format(
+        (time.perf_counter() - STARTED) * 1000, ", ".join(heavy) if heavy else "none"))
+
+# How long each stage took, collected for --metrics
+metrics = Metrics()
+# The strategy that aligned the last payslip of each layout, which is tried first for the next.
+# It is kept in the cache directory unless --no-cache
+strategies = Strategies()
+
+
+def month_from_name(pdf: pathlib.Path):
+    """
+    Find the month of a payslip from its filename
+    :param pdf: the payslip
+    :return: the month formatted as YYYY-MM, or None if the file has been renamed
+    """
+    matches = re.search(MONTH_REGEX, pdf.name)
+    if not matches:
+        return None
+    month = matches.group(2) + "-" + str(get_month(matches.group(1))).zfill(2)
+    logger.info("Found month: %s", month)
+    return month
+
+
+def ask_month(pdf: pathlib.Path) -> str:
+    """
+    Ask for the month of a payslip, when it could not be found in the filename or the pdf.
+    This always runs in the main process, so the worker processes never block on input()
+    """
+    logger.info("Please do not change the name of the pdf files.")
+    logger.info("I've found the following file: %s", pdf.name)
+    return input("What is the month of {}? (YYYY-MM) ex: 2019-01: ".format(pdf.name))
+
+
+def start_parse(pdf: pathlib.Path, executor: ProcessPoolExecutor = None, cache: ParseCache = None,
+                engine: str = "camelot", katalog: kodekatalog.Katalog = None, layouts: dict = None,
+                with_month: bool = False) -> tuple:
+    """
+    Get the pdf from the cache, or start parsing it in the pool
+    :param with_month: look for the month in the pdf, for the pdfs where it is not in the filename
+    :return: the cache key, and the parsed columns, a Future of them or None if it should be parsed in this process
+    """
+    key = cache.key(pdf) if cache else None
+    parsed = cache.get(key) if cache else None
+    if parsed is not None and with_month and "month" not in parsed:
+        # It was parsed while the month was in the filename, so the month was not looked for
+        parsed = None
+    if parsed is not None:
+        logger.info("Found %s in cache", pdf.name)
+        metrics.count("cache_hits")
+    elif cache:
+        metrics.count("cache_misses")
+    if parsed is None and executor:
+        parsed = executor.submit(parse, pdf, engine, katalog, layouts, strategies.remembered, with_month)
+    return key, parsed
+
+
+def finish_parse(pdf: pathlib.Path, key: str, parsed, cache: ParseCache = None, engine: str = "camelot",
+                 katalog: kodekatalog.Katalog = None, layouts: dict = None, with_month: bool = False) -> dict:
+    """
+    Wait for the pdf started with start_parse, and add it to the cache
+    :return: the parsed columns
+    """
+    if parsed is not None and not isinstance(parsed, Future):
+        return parsed
+    logger.info("Parsing %s", pdf.name)
+    parsed = parsed.result() if isinstance(parsed, Future) else parse(pdf, engine, katalog, layouts,
+                                                                      strategies.remembered, with_month)
+    logger.info("Parsed %s", pdf.name)
+    metrics.count("parsed")
+    # The timings are from the process that parsed the pdf, and are not cached
+    metrics.add_file(pdf.name, parsed.pop("timings", {}))
+    layout, _, second_pass = parsed.pop("strategy", (None, None, None))
+    strategies.record(layout, second_pass)
+    if cache:
+        cache.put(key, parsed)
+    return parsed
+
+
+def aggregate_months(parsed_months: dict) -> dict:
+    """
+    Calculate the stocks and, unless --simple, add every line item for a chunk of parsed months
+    :param parsed_months: dict of month to the columns returned by parse
+    :return: dict of month to its result
+    """
+    with metrics.timed("aggregate"):
+        if argz.simple:
+            # Nothing needs the table, so pandas is not imported
+            return aggregate.stocks_only(parsed_months)
+        table = aggregate.to_table(parsed_months)
+        stocks = aggregate.stocks(table, list(parsed_months))
+        logger.info("Finished calculating stocks for %s months", len(stocks))
+        return aggregate.to_nested(table, stocks, argz.simple)
+
 
-def yoink_all_pdfs(root_dir: pathlib.Path) -> dict:
-    logger.info("Yoinking all pdfs from %s", root_dir)
-    regex = r"Lønseddel - loenseddel([a-z]+)(\d{4}).*.PDF"
-    res: dict = {}
-    for pdf in root_dir.glob("*"):
-        if not pdf.name.lower().endswith("pdf"):
+def find_pdfs(root_dir: pathlib.Path, batch: bool = False) -> dict:
+    """
+    Find the pdfs in root_dir. With batch every folder in root_dir is an employee, and their pdfs are
+    found recursively
+    :return: dict of employee to the pdfs, where the employee is None when not in batch
+    """
+    pdfs = {}
+    for pdf in sorted(root_dir.rglob("*") if batch else root_dir.glob("*")):
+        if not pdf.name.lower().endswith("pdf") or not pdf.is_file():
             logger.info("Skipping %s, as not pdf", pdf.name)
             continue
+        employee = None
+        if batch:
+            parts = pdf.relative_to(root_dir).parts
+            employee = parts[0] if len(parts) > 1 else root_dir.resolve().name
+        pdfs.setdefault(employee, []).append(pdf)
+    return pdfs
+
+
+def pick_duplicate(employee: str, month: str, pdfs: list) -> pathlib.Path:
+    """
+    Choose which of the pdfs for the same month to use
+    Copies of the same pdf are just skipped. If they are different, it is assumed that the most recently
+    modified is a corrected payslip
+    """
+    unique = {}
+    for pdf in pdfs:
+        unique.setdefault(file_hash(pdf), pdf)
+    if len(unique) == 1:
+        logger.info("Skipping %s, as they are copies of %s", ", ".join(x.name for x in pdfs[1:]), pdfs[0].name)
+        return pdfs[0]
+    names = ", ".join(str(x) for x in unique.values())
+    if argz.on_duplicate == "error":
+        raise Exception("{} has different pdfs for {}: {}".format(employee or "The input", month, names))
+    newest = max(unique.values(), key=lambda x: x.stat().st_mtime)
+    logger.warning("%s has different pdfs for %s: %s. Using %s as the corrected one",
+                   employee or "The input", month, names, newest)
+    return newest
+
+
+def plan_pdfs(pdfs: dict, skip=(), executor: ProcessPoolExecutor = None, cache: ParseCache = None,
+              engine: str = "camelot", katalog: kodekatalog.Katalog = None, layouts: dict = None) -> (list, list):
+    """
+    Resolve the month of every pdf up front, and pick one pdf when there is more than one for a month.
+    Pdfs that has been renamed are parsed here, to find the month in the pdf itself
+    :param pdfs: dict of employee to pdfs, from find_pdfs
+    :param skip: (employee, month) that are already parsed
+    :return: list of (employee, month, pdf, parsed or None) sorted by employee and then month,
+     and a list of the pdfs where the month could not be found, with the reason
+    """
+    months = {}
+    renamed = []
+    for employee, employee_pdfs in pdfs.items():
+        for pdf in employee_pdfs:
+            month = month_from_name(pdf)
+            if month is None:
+                renamed.append((employee, pdf))
+                continue
+            months.setdefault((employee, month), []).append((pdf, None))
+
+    unresolved = []
+    started = [(employee, pdf, *start_parse(pdf, executor, cache, engine, katalog, layouts, True))
+               for employee, pdf in renamed]
+    for employee, pdf, key, parsed in started:
         try:
-            logger.info("Parsing %s", pdf.name)
-            parsed = parse(pdf)
+            parsed = finish_parse(pdf, key, parsed, cache, engine, katalog, layouts, True)
+        except BrokenProcessPool:
+            # Not the fault of the pdf, the pool has to be started again
+            raise
         except Exception as e:
-            raise Exception("{} {}".format(pdf.name, e))
-        logger.info("Parsed %s", pdf.name)
-        matches = re.search(regex, pdf.name)
-        if not matches:
-            logger.info("Please do not change the name of the pdf files.")
-            logger.info("I've found the following file: {}".format(pdf.name))
-            month = input("What is the month of this file? (YYYY-MM) ex: 2019-01: ")
-        else:
-            month = matches.group(2) + "-" + str(get_month(matches.group(1))).zfill(2)
-            logger.info("Found month: {}".format(month))
-        res[month] = {}
-        emp = sum(
-            [get_float(parsed["Antal"][i]) for i, x in enumerate(parsed["Art"]) if
-             x == "5092"])
-        addit = -1 * sum(get_float(parsed["Beløb"][i]) for i, x in
-                         enumerate(parsed["Art"]) if x == "9221")
-        logger.info(
-            "Finished calculating stocks for emp and addit: Employer matched (up to 2.5% of salary): [{}], additional stocks: [{}]".format(
-                emp, addit))
-
-        if not argz.simple:
-            logger.info("Adding everything to result")
-            for i, x in enumerate(parsed["Art"]):
-                s = parsed["Specifikation"][i] if parsed["Specifikation"][i] else ""
-                b = get_float(parsed["Beløb"][i]) if parsed["Beløb"][i] else None
-                a = get_float(parsed["Antal"][i]) if parsed["Antal"][i] else None
-                sa = get_float(parsed["Sats"][i]) if parsed["Sats"][i] else None
-
-                res[month][x] = {"Specifikation": s, "Beløb": b, "Antal": a, "Sats": sa}
-        logger.info("Adding stocks to result")
-        res[month]["Employers_Matched_Contribution"] = emp
-        res[month]["Additional_contribution"] = addit
-        res[month]["Stocks_total"] = emp + addit
-    return res
+            logger.error("%s %s", pdf, e)
+            unresolved.append({"pdf": str(pdf), "reason": "Could not be parsed: {}".format(e)})
+            continue
+        month = parsed.get("month")
+        if month is None:
+            if argz.non_interactive:
+                logger.error("Could not find the month of %s", pdf)
+                unresolved.append({"pdf": str(pdf), "reason": "The month is not in the filename or the pdf"})
+                continue
+            month = ask_month(pdf)
+        logger.info("Found month %s in %s", month, pdf.name)
+        months.setdefault((employee, month), []).append((pdf, parsed))
 
+    plan = []
+    for (employee, month), month_pdfs in months.items():
+        if (employee, month) in skip:
+            logger.info("Skipping %s, as %s is already in the output", ", ".join(x.name for x, _ in month_pdfs), month)
+            continue
+        pdf, parsed = month_pdfs[0]
+        if len(month_pdfs) > 1:
+            pdf = pick_duplicate(employee, month, [x for x, _ in month_pdfs])
+            parsed = dict(month_pdfs)[pdf]
+        plan.append((employee, month, pdf, parsed))
+    return sorted(plan, key=result_sort_key), unresolved
 
-def main():
-    root_dir = pathlib.Path(argz.input)
-    if not root_dir.exists():
-        raise Exception("The root directory does not exist")
-    res = yoink_all_pdfs(root_dir)
 
-    sorted_res = OrderedDict(
-        sorted(res.items(), key=lambda x: float(x[0].split("-")[0]) + float(x[0].split("-")[1]) / 12))
+def result_sort_key(item: tuple) -> tuple:
+    """
+    Sort by employee and then month, for (employee, month, ...) tuples
+    """
+    return item[0] or "", month_sort_key(item[1])
 
-    logger.info("Finished yoinking all pdfs")
 
+def yoink_all_pdfs(plan: list, jobs: int = 1, cache: ParseCache = None, engine: str = "camelot",
+                   katalog: kodekatalog.Katalog = None, executor: ProcessPoolExecutor = None, layouts: dict = None,
+                   store: Store = None):
+    """
+    Parse all the pdfs in the plan through the same pool, and yield the result of each month as soon as it is ready,
+    in the same order as the plan.
+    Only a window of pdfs are parsed ahead of what has been yielded, so the memory used does not grow
+    with the number of pdfs
+    :param plan: list of (employee, month, pdf, parsed or None) from plan_pdfs
+    :param executor: the pool to parse in, or None to parse in this process
+    :param store: where to store the line items of the parsed pdfs, a chunk at a time
+    :return: generator of (employee, month, result)
+    """
+    logger.info("Yoinking %s pdfs", len(plan))
+    todo = iter(plan)
+
+    def start(employee: str, month: str, pdf: pathlib.Path, parsed) -> tuple:
+        if parsed is not None:
+            return employee, month, pdf, None, parsed
+        return (employee, month, pdf, *start_parse(pdf, executor, cache, engine, katalog, layouts))
+
+    window = deque()
+    chunk = {}
+    chunk_employee = None
+    # (employee, month, pdf, parsed) of the chunk, for the store
+    chunk_pdfs = []
+    failed = {}
+    try:
+        for _ in range(max(jobs, 1) * WINDOW_PER_JOB):
+            item = next(todo, None)
+            if item:
+                window.append(start(*item))
+        while window:
+            employee, month, pdf, key, parsed = window.popleft()
+            item = next(todo, None)
+            if item:
+                window.append(start(*item))
+            try:
+                parsed = finish_parse(pdf, key, parsed, cache, engine, katalog, layouts)
+            except BrokenProcessPool:
+                # Not the fault of the pdf, the pool has to be started again
+                raise
+            except Exception as e:
+                # One broken payslip should not throw away the rest of the batch
+                logger.error("%s %s", pdf, e)
+                failed[str(pdf)] = e
+                metrics.count("failed")
+                continue
+            metrics.count("rows", len(parsed["Art"]))
+            # Aggregating a chunk of months at a time, keeps most of the speed of aggregating everything at once
+            if chunk and (employee != chunk_employee or len(chunk) == CHUNK_SIZE):
+                if store:
+                    with metrics.timed("store"):
+                        store.add_all(chunk_pdfs)
+                    chunk_pdfs = []
+                for chunk_month, values in aggregate_months(chunk).items():
+                    yield chunk_employee, chunk_month, values
+                chunk = {}
+            chunk_employee = employee
+            chunk[month] = parsed
+            if store:
+                chunk_pdfs.append((employee, month, pdf, parsed))
+        if chunk:
+            if store:
+                with metrics.timed("store"):
+                    store.add_all(chunk_pdfs)
+            for chunk_month, values in aggregate_months(chunk).items():
+                yield chunk_employee, chunk_month, values
+    finally:
+        # Stop parsing what is left in the window, if the consumer stops early
+        for item in window:
+            if isinstance(item[-1], Future):
+                item[-1].cancel()
+    if failed:
+        logger.error("Failed to parse %s of %s pdfs: %s", len(failed), len(plan), ", ".join(failed))
+        unknown = sorted({code for e in failed.values() if isinstance(e, kodekatalog.UnknownCodes) for code in e.codes})
+        if unknown:
+            logger.error("These codes need to be added to the kodekatalog: %s", ", ".join(unknown))
+
+
+def output_name(out, employee: str = None) -> str:
+    """
+    :param out: the output format
+    :param employee: the employee, when writing an output for each employee
+    """
+    path = pathlib.Path(argz.output)
+    outname = argz.output
+    if employee is not None and not argz.combined:
+        outname = str(path.with_name(path.stem + "-" + employee + path.suffix))
+    if path.suffix == "":
+        outname = outname + "." + out._get_name()
+    return outname
+
+
+def output_key(employee: str, month: str) -> str:
+    """
+    The key a month is written with. In a combined output the employee is added in front of the month
+    """
+    if employee is not None and argz.combined:
+        return employee + "/" + month
+    return month
+
+
+def load_previous(employee: str = None) -> dict:
+    """
+    Load the result of the last run, from the first of the chosen output formats that can be read back
+    :param employee: the employee, when there is an output for each employee
+    :return: the previous result as a dict of (employee, month) to its result,
+     or an empty dict if there has not been a previous run
+    """
+    loadable = [out for out in argz.output_format if out.loadable]
+    if not loadable:
+        raise Exception("--incremental needs JSON, JSONL or Pickle in the output formats")
+    for out in loadable:
+        outname = output_name(out, employee)
+        if pathlib.Path(outname).exists():
+            logger.info("Loading previous result from %s", outname)
+            previous = {}
+            for key, values in out(argz.number_format).load(outname).items():
+                if employee is None and "/" in key:
+                    # Combined output of all employees
+                    previous[tuple(key.split("/", 1))] = values
+                else:
+                    previous[(employee, key)] = values
+            return previous
+    logger.info("No previous result found, parsing everything")
+    return {}
+
+
+def open_writers(employee: str = None) -> list:
+    writers = []
     if argz.output:
-        logger.info("Writing to file: %s", argz.output)
+        logger.info("Writing to file: %s", output_name(argz.output_format[0], employee))
         # use format located in argz.output_format
         if argz.output_format is not None:
             for out in argz.output_format:
-                outname = argz.output
-                if pathlib.Path(argz.output).suffix == "":
-                    outname = argz.output + "." + out._get_name()
-                out(argz.number_format).save(sorted_res, outname)
+                writer = out(argz.number_format)
+                writer.open(output_name(out, employee))
+                writers.append(writer)
+    return writers
+
+
+def close_writers(writers: list):
+    for writer in writers:
+        with metrics.timed("write_" + writer.name):
+            writer.close()
+
+
+def write_all(pdfs: dict, previous: dict, executor: ProcessPoolExecutor, cache: ParseCache,
+              katalog: kodekatalog.Katalog, layouts: dict = None, store: Store = None):
+    """
+    Parse the pdfs and write them, merged with the previous result, to the outputs
+    """
+    plan, unresolved = plan_pdfs(pdfs, previous.keys(), executor, cache, argz.engine, katalog, layouts)
+    if unresolved:
+        logger.error("Could not find the month of %s pdfs, see %s", len(unresolved), argz.unresolved_report)
+        with open(argz.unresolved_report, 'w') as f:
+            json.dump(unresolved, f, indent=2)
+    res = yoink_all_pdfs(plan, argz.jobs, cache, argz.engine, katalog, executor, layouts, store)
+    if previous:
+        logger.info("Merging the new months into %s previous months", len(previous))
+        res = heapq.merge(sorted(((e, m, v) for (e, m), v in previous.items()), key=result_sort_key), res,
+                          key=result_sort_key)
+
+    writers = []
+    current = None
+    try:
+        # Each month is written as soon as it is parsed, so nothing keeps the whole result in memory.
+        # The results are sorted by employee, so an employee is done when the next one starts
+        for employee, month, values in res:
+            if not writers or (employee != current and not argz.combined):
+                close_writers(writers)
+                writers = open_writers(employee)
+                current = employee
+            for writer in writers:
+                with metrics.timed("write_" + writer.name):
+                    writer.write(output_key(employee, month), values)
+    finally:
+        close_writers(writers)
+    if not writers and not (argz.batch and not argz.combined):
+        # Nothing was found, but there should still be an (empty) output
+        close_writers(open_writers())
+
+
+def run(root_dir: pathlib.Path, executor: ProcessPoolExecutor, cache: ParseCache, katalog: kodekatalog.Katalog,
+        layouts: dict):
+    """
+    Find the pdfs in root_dir, and write them to the outputs
+    """
+    pdfs = find_pdfs(root_dir, argz.batch)
+    previous = {}
+    if argz.incremental:
+        if argz.batch and not argz.combined:
+            for employee in pdfs:
+                previous.update(load_previous(employee))
+        else:
+            previous = load_previous()
+    store = Store(argz.db, katalog.version) if argz.db else None
+    try:
+        write_all(pdfs, previous, executor, cache, katalog, layouts, store)
+    finally:
+        if store:
+            store.close()
+    logger.info("Finished yoinking all pdfs")
+    if cache:
+        cache.evict()
+    if argz.metrics:
+        metrics.save(argz.metrics)
+
+
+def start_pool():
+    """
+    The pool imports the engine when it starts, so it is ready when the pdfs arrive
+    :return: the pool, or None when the pdfs are parsed in this process
+    """
+    if argz.jobs <= 1:
+        return None
+    return ProcessPoolExecutor(max_workers=argz.jobs, initializer=warm_up, initargs=(argz.engine,))
+
+
+def run_in_pool(root_dir: pathlib.Path, executor: ProcessPoolExecutor, cache: ParseCache,
+                katalog: kodekatalog.Katalog, layouts: dict) -> ProcessPoolExecutor:
+    """
+    run, but if a process in the pool dies, eg. killed for using too much memory, a new pool is started and
+    it is run again, so the outputs are not left half written. What was parsed before is found in the cache
+    :return: the pool in use, as it is replaced if a process dies
+    """
+    for restart in range(POOL_RESTARTS + 1):
+        try:
+            run(root_dir, executor, cache, katalog, layouts)
+            return executor
+        except BrokenProcessPool as e:
+            executor.shutdown(cancel_futures=True)
+            if restart == POOL_RESTARTS:
+                raise
+            logger.error("A process in the pool died (%s), starting a new pool and running again", e)
+            executor = start_pool()
+
+
+def watch_folder(root_dir: pathlib.Path, executor: ProcessPoolExecutor, cache: ParseCache,
+                 katalog: kodekatalog.Katalog, layouts: dict) -> ProcessPoolExecutor:
+    """
+    Update the outputs every time pdfs are added, changed or removed, until stopped with ctrl+c.
+    The pool and the imports are kept between the updates, and the pdfs already parsed are found in the cache,
+    or skipped with --incremental
+    :return: the pool in use when stopped, as it is replaced if a process dies
+    """
+    if cache is None and not argz.incremental:
+        logger.warning("Every change parses all the pdfs again, use the cache or --incremental to avoid it")
+    # Imported now, so the first update does not wait for it
+    warm_up(argz.engine)
+    import pandas  # noqa: F401
+    watcher = get_watcher(root_dir, argz.batch, argz.poll_interval, argz.watcher)
+    logger.info("Watching %s with %s", root_dir, watcher)
+    try:
+        for changed in batches(watcher):
+            logger.info("%s pdfs changed: %s", len(changed), ", ".join(x.name for x in sorted(changed)))
+            try:
+                executor = run_in_pool(root_dir, executor, cache, katalog, layouts)
+            except BrokenProcessPool as e:
+                # It died every time, a new pool is still started for the next change
+                logger.error("A process in the pool died (%s), starting a new pool", e)
+                executor.shutdown(cancel_futures=True)
+                executor = start_pool()
+            except Exception as e:
+                # The next change might fix it, eg. a pdf that was not completely copied
+                logger.error("Could not update the outputs: %s", e)
+    except KeyboardInterrupt:
+        logger.info("Stopped watching %s", root_dir)
+    finally:
+        watcher.close()
+    return executor
+
+
+def main():
+    global strategies
+    root_dir = pathlib.Path(argz.input)
+    if not root_dir.exists():
+        raise Exception("The root directory does not exist")
+    katalog = kodekatalog.load(argz.kodekatalog)
+    layouts = load_layouts(argz.layouts)
+    cache = None
+    if not argz.no_cache:
+        cache = ParseCache(argz.cache_dir, int(argz.cache_max_size * 1024 * 1024), argz.cache_max_age * 24 * 60 * 60,
+                           katalog.version, argz.engine, layouts)
+        strategies = Strategies(cache.directory / "strategies.json")
+    executor = start_pool()
+    try:
+        executor = run_in_pool(root_dir, executor, cache, katalog, layouts)
+        if argz.watch:
+            executor = watch_folder(root_dir, executor, cache, katalog, layouts)
+    finally:
+        if executor:
+            executor.shutdown(cancel_futures=True)
+        strategies.save()
 
 
 if __name__ == '__main__':
-    main()
+    if argz.profile:
+        import cProfile
+        cProfile.run("main()", argz.profile)
+    else:
+        main()
@@ -0,0 +1,65 @@
+import contextlib
+import json
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class Metrics:
+    """
+    Collects how long each stage took, for each file and in total, and counters like cache hits.
+    The timings of a single pdf are made in the process that parsed it, and added to the main process
+    with add_file, as they are sent back with the parsed columns.
+    """
+
+    def __init__(self):
+        # stage to the total seconds
+        self.stages = {}
+        # file to stage to seconds
+        self.files = {}
+        self.counters = {}
+
+    @contextlib.contextmanager
+    def timed(self, stage: str, file: str = None):
+        """
+        Time the with block as stage, eg. with metrics.timed("extract", pdf.name):
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(stage, time.perf_counter() - start, file)
+
+    def add(self, stage: str, seconds: float, file: str = None):
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+        if file is not None:
+            stages = self.files.setdefault(file, {})
+            stages[stage] = stages.get(stage, 0.0) + seconds
+
+    def add_file(self, file: str, stages: dict):
+        """
+        Add the stages timed somewhere else, eg. in the process that parsed the file
+        :param stages: dict of stage to seconds
+        """
+        for stage, seconds in stages.items():
+            self.add(stage, seconds, file)
+
+    def count(self, counter: str, amount: int = 1):
+        self.counters[counter] = self.counters.get(counter, 0) + amount
+
+    def summary(self) -> dict:
+        """
+        :return: the totals of each stage, the counters and the timings of each file
+        """
+        return {
+            "stages": {stage: round(seconds, 6) for stage, seconds in self.stages.items()},
+            "counters": dict(self.counters),
+            "files": {file: {stage: round(seconds, 6) for stage, seconds in stages.items()}
+                      for file, stages in self.files.items()},
+        }
+
+    def save(self, filename: str):
+        logger.info("Writing metrics to %s", filename)
+        with open(filename, 'w') as f:
+            json.dump(self.summary(), f, indent=2, ensure_ascii=False)
@@ -0,0 +1,87 @@
+import re
+from collections import namedtuple
+from decimal import Decimal
+
+# The minus can also be after the number, like "1.234,56-" on some payslips, and can be the unicode minus
+MINUS = "-−"
+# A number is an optional sign, the whole part with or without thousands separators, and an optional fraction.
+# There are no groups, as the match is only used to check the number, which is faster
+PATTERNS = {
+    "dk": re.compile(r"[-+−]?(?:\d{1,3}(?:\.\d{3})*|\d+)(?:,\d+)?[-−]?"),
+    "en": re.compile(r"[-+−]?(?:\d{1,3}(?:,\d{3})*|\d+)(?:\.\d+)?[-−]?"),
+}
+# Turns a checked number into what float and Decimal reads, in a single pass over the string
+TABLES = {
+    "dk": str.maketrans({".": None, ",": ".", "−": "-"}),
+    "en": str.maketrans({",": None, "−": "-"}),
+}
+
+# A cell that could not be read as a number, row is the index in the column
+Malformed = namedtuple("Malformed", ["row", "code", "column", "text"])
+
+
+class MalformedNumber(ValueError):
+    def __init__(self, text: str, number_format: str = "dk"):
+        super().__init__("{!r} is not a {} formatted number".format(text, number_format))
+        self.text = text
+
+
+def _read(text: str, fullmatch, table: dict, exact: bool):
+    """
+    :return: the number, None if text is empty, or False if it is not a number
+    """
+    if fullmatch(text) is None:
+        text = text.strip()
+        if text == "":
+            return None
+        if fullmatch(text) is None:
+            return False
+    if text[-1] in MINUS:
+        if text[0] in MINUS or text[0] == "+":
+            # A sign in both ends
+            return False
+        number = Decimal(text[:-1].translate(table)) if exact else float(text[:-1].translate(table))
+        return -number
+    return Decimal(text.translate(table)) if exact else float(text.translate(table))
+
+
+def parse(text: str, number_format: str = "dk", exact: bool = False):
+    """
+    Read a number formatted like on the payslips, eg. 1.234,56 or 1.234,56- in dk, or 1,234.56 in en.
+    Unlike util_functions.get_float, a cell that is not a number is an error, and not 0.0
+    :param text: the cell
+    :param number_format: dk or en
+    :param exact: return a Decimal instead of a float, for exact sums of money
+    :return: the number, or None if the cell is empty
+    """
+    number = _read(text, PATTERNS[number_format].fullmatch, TABLES[number_format], exact)
+    if number is False:
+        raise MalformedNumber(text, number_format)
+    return number
+
+
+def parse_column(values: list, codes: list = None, column: str = None, number_format: str = "dk",
+                 exact: bool = False, malformed_value=None) -> (list, list):
+    """
+    Read a whole column of numbers at once
+    :param values: the cells of the column
+    :param codes: the Art of each row, to tell which line item a malformed cell is from
+    :param column: the name of the column, eg. Beløb
+    :param malformed_value: what to use for the cells that are not numbers
+    :return: the numbers with None for empty cells, and the cells that could not be read
+    """
+    fullmatch = PATTERNS[number_format].fullmatch
+    table = TABLES[number_format]
+    numbers = []
+    malformed = []
+    for row, text in enumerate(values):
+        # The common case of a number without spaces is done here, as a call of _read for every cell is slower
+        if not exact and fullmatch(text) is not None and text[-1] not in MINUS:
+            numbers.append(float(text.translate(table)))
+            continue
+        number = _read(text, fullmatch, table, exact)
+        if number is False:
+            malformed.append(Malformed(row, codes[row] if codes is not None else None, column, text))
+            number = malformed_value
+        numbers.append(number)
+    return numbers, malformed
@@ -4,25 +4,56 @@ from collections import OrderedDict
 
 
 class OutFunctionsBase(ABC):
+    """
+    Writes the result one month at a time, in the order they are given.
+    open is called first, then write for each month as soon as it is parsed, and close at the end.
+    """
     name = None
+    # If the output can be read back with load, which is needed for --incremental
+    loadable = False
 
     def __init__(self, number_format):
         self.name = self._get_name()
         self.number_format = number_format
+        self.file = None
+
+    def open(self, filename: str):
+        raise NotImplementedError("This needs to be implemented.")
+
+    def write(self, key: str, values: dict):
+        raise NotImplementedError("This needs to be implemented.")
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
 
     def save(self, data: OrderedDict, filename: str):
-        raise NotImplemented("This needs to be implemented.")
+        """
+        Write a whole result at once
+        """
+        self.open(filename)
+        try:
+            for key, values in data.items():
+                self.write(key, values)
+        finally:
+            self.close()
+
+    def load(self, filename: str) -> OrderedDict:
+        raise NotImplementedError("{} can not be loaded.".format(self._get_name()))
 
     def __str__(self):
         return self._get_name()
 
     @staticmethod
     def _get_name():
-        raise NotImplemented("This needs to be implemented.")
+        raise NotImplementedError("This needs to be implemented.")
 
 
 # Sort yyyy-mm formatted dates, where it is split up into yyyy and mm. The
 # oldest should be first.
+def month_sort_key(month: str) -> float:
+    return float(month.split("-")[0]) + float(month.split("-")[1]) / 12
 
 
 class CSV(OutFunctionsBase):
@@ -33,25 +64,25 @@ class CSV(OutFunctionsBase):
         "Stocks_total"
     ]
 
-    def save(self, data: OrderedDict, filename: str):
+    def open(self, filename: str):
         import csv
-        with open(filename, 'w', newline='') as csvfile:
-            dict_writer = csv.DictWriter(csvfile, fieldnames=self.headers)
-            dict_writer.writeheader()
-
-            for key, values in data.items():
-                if key == "key":
-                    continue
-                dict_writer.writerow({
-                    "yyyy-mm": key,
-                    "Employers_Matched_Contribution": values[
-                        "Employers_Matched_Contribution"] if self.number_format == "en" else str(
-                        values["Employers_Matched_Contribution"]).replace(".", ","),
-                    "Additional_contribution": values["Additional_contribution"] if self.number_format == "en" else str(
-                        values["Additional_contribution"]).replace(".", ","),
-                    "Stocks_total": values["Stocks_total"] if self.number_format == "en" else str(
-                        values["Stocks_total"]).replace(".", ",")
-                })
+        self.file = open(filename, 'w', newline='')
+        self.dict_writer = csv.DictWriter(self.file, fieldnames=self.headers)
+        self.dict_writer.writeheader()
+
+    def write(self, key: str, values: dict):
+        if key == "key":
+            return
+        self.dict_writer.writerow({
+            "yyyy-mm": key,
+            "Employers_Matched_Contribution": values[
+                "Employers_Matched_Contribution"] if self.number_format == "en" else str(
+                values["Employers_Matched_Contribution"]).replace(".", ","),
+            "Additional_contribution": values["Additional_contribution"] if self.number_format == "en" else str(
+                values["Additional_contribution"]).replace(".", ","),
+            "Stocks_total": values["Stocks_total"] if self.number_format == "en" else str(
+                values["Stocks_total"]).replace(".", ",")
+        })
 
     @staticmethod
     def _get_name():
@@ -59,20 +90,70 @@ class CSV(OutFunctionsBase):
 
 
 class JSON(OutFunctionsBase):
-    def save(self, data: OrderedDict, filename: str):
+    """
+    A single json object of all the months. Each month is written as it arrives, so the file is the same
+    as dumping the whole result at once
+    """
+    loadable = True
+
+    def open(self, filename: str):
+        self.file = open(filename, 'w')
+        self.file.write("{")
+        self.first = True
+
+    def write(self, key: str, values: dict):
+        import json
+        if not self.first:
+            self.file.write(", ")
+        self.first = False
+        self.file.write(json.dumps(key) + ": " + json.dumps(values))
+
+    def close(self):
+        if self.file is not None:
+            self.file.write("}")
+        super().close()
+
+    def load(self, filename: str) -> OrderedDict:
         import json
-        with open(filename, 'w') as f:
-            json.dump(data, f)
+        with open(filename) as f:
+            return json.load(f, object_pairs_hook=OrderedDict)
 
     @staticmethod
     def _get_name():
         return "JSON"
 
 
+class JSONL(OutFunctionsBase):
+    """
+    Json lines, with an object of a single month on each line
+    """
+    loadable = True
+
+    def open(self, filename: str):
+        self.file = open(filename, 'w')
+
+    def write(self, key: str, values: dict):
+        import json
+        self.file.write(json.dumps({key: values}) + "\n")
+
+    def load(self, filename: str) -> OrderedDict:
+        import json
+        data = OrderedDict()
+        with open(filename) as f:
+            for line in f:
+                if line.strip():
+                    data.update(json.loads(line, object_pairs_hook=OrderedDict))
+        return data
+
+    @staticmethod
+    def _get_name():
+        return "JSONL"
+
+
 class XML(OutFunctionsBase):
-    def save(self, data: OrderedDict, filename: str):
+    def open(self, filename: str):
         import xml.etree.ElementTree as ET
-        raise NotImplemented("This needs to be implemented.")
+        raise NotImplementedError("This needs to be implemented.")
 
     @staticmethod
     def _get_name():
@@ -80,10 +161,16 @@ class XML(OutFunctionsBase):
 
 
 class YAML(OutFunctionsBase):
-    def save(self, data: OrderedDict, filename):
+    """
+    A yaml document for each month, so it can be read with yaml.safe_load_all
+    """
+
+    def open(self, filename: str):
+        self.file = open(filename, 'w')
+
+    def write(self, key: str, values: dict):
         import yaml
-        with open(filename, 'w') as f:
-            yaml.dump(data, f)
+        yaml.safe_dump({key: values}, self.file, explicit_start=True, allow_unicode=True, sort_keys=False)
 
     @staticmethod
     def _get_name():
@@ -91,16 +178,107 @@ class YAML(OutFunctionsBase):
 
 
 class Pickle(OutFunctionsBase):
-    def save(self, data: OrderedDict, filename):
+    """
+    A single pickled OrderedDict. Pickle can not be written a month at a time, so this is the only
+    writer that keeps the whole result in memory until it is closed
+    """
+    loadable = True
+
+    def open(self, filename: str):
+        self.file = open(filename, 'wb')
+        self.data = OrderedDict()
+
+    def write(self, key: str, values: dict):
+        self.data[key] = values
+
+    def close(self):
         import pickle
-        with open(filename, 'wb') as f:
-            pickle.dump(data, f)
+        if self.file is not None:
+            pickle.dump(self.data, self.file)
+            self.data = None
+        super().close()
+
+    def load(self, filename: str) -> OrderedDict:
+        import pickle
+        with open(filename, 'rb') as f:
+            return pickle.load(f)
 
     @staticmethod
     def _get_name():
         return "Pickle"
 
 
+class Parquet(OutFunctionsBase):
+    """
+    Every line item in parquet files partitioned by year, as filename/year=yyyy/part-n.parquet.
+    The numbers are stored as doubles, and not as text in the number format, so it can be queried directly.
+    The stocks are not line items, so they are not written, and nothing is written with --simple.
+    In a combined output the employee is in its own column, so month is always yyyy-mm
+    """
+    columns = ["employee", "month", "Art", "Specifikation", "Antal", "Sats", "Beløb"]
+
+    def open(self, filename: str):
+        import pathlib
+        self.directory = pathlib.Path(filename)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        # Remove the files from an earlier run, so a year that is no longer there is not left behind
+        for old in self.directory.glob("year=*/*.parquet"):
+            old.unlink()
+        self.year = None
+        self.parts = {}
+        self.rows = {column: [] for column in self.columns}
+
+    def write(self, key: str, values: dict):
+        # The key is employee/yyyy-mm in a combined output
+        employee, _, month = key.rpartition("/")
+        year = month.split("-")[0]
+        if year != self.year:
+            self._flush()
+            self.year = year
+        for art, item in values.items():
+            # The stocks are floats and not line items
+            if not isinstance(item, dict):
+                continue
+            self.rows["employee"].append(employee or None)
+            self.rows["month"].append(month)
+            self.rows["Art"].append(art)
+            for column in self.columns[3:]:
+                self.rows[column].append(item[column])
+
+    def _flush(self):
+        """
+        Write the line items of the current year
+        """
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        if not self.rows["month"]:
+            return
+        schema = pa.schema([
+            ("employee", pa.string()),
+            ("month", pa.string()),
+            ("Art", pa.string()),
+            ("Specifikation", pa.string()),
+            ("Antal", pa.float64()),
+            ("Sats", pa.float64()),
+            ("Beløb", pa.float64()),
+        ])
+        partition = self.directory / "year={}".format(self.year)
+        partition.mkdir(exist_ok=True)
+        # A year is written more than once, when a combined output goes through the years for each employee
+        part = self.parts.get(self.year, 0)
+        self.parts[self.year] = part + 1
+        pq.write_table(pa.table(self.rows, schema=schema), partition / "part-{}.parquet".format(part),
+                       compression="zstd")
+        self.rows = {column: [] for column in self.columns}
+
+    def close(self):
+        self._flush()
+
+    @staticmethod
+    def _get_name():
+        return "Parquet"
+
+
 class SelectOutAction(Action):
     """
         Argparse action for handeling a list of classes with OutFunctionsBase type.
@@ -124,4 +302,4 @@ class SelectOutAction(Action):
         setattr(namespace, self.dest, chosen)
 
 
-out_functions: [OutFunctionsBase] = [CSV, JSON, XML, YAML, Pickle]
+out_functions: [OutFunctionsBase] = [CSV, JSON, JSONL, XML, YAML, Pickle, Parquet]
@@ -1,100 +1,265 @@
 import logging
 import pathlib
 import re
-
-import camelot
+import time
 
 import kodekatalog
+import reconcile
+from extraction import fallback, get_extractor, second_pass
+from metrics import Metrics
 from util_functions import get_float
 
 logger = logging.getLogger(__name__)
 
+# Bump this when a change to the parser changes its output, so old cached results are not used
+PARSER_VERSION = "3"
+
+
+def skat_af(index: int, columns: dict) -> (bool, bool):
+    """
+    The pay can have zero in beløb for A-indk (8906) if there is no income
+    """
+    regex = r".*Skat af (.*)"
+    logger.info("Try'n see if special case for 8906 is applicable")
+    matches = re.search(regex, columns["Specifikation"][index])
+    if matches:
+        # Sometimes the table generates weirdly and Fradrag is actually AFTER Skat af.
+        # To combat this (I've only seen it once) so to combat this we are just checking if that is the case
+        fml = matches.group(1)
+        reee = r"(.*) Fradrag:.*"
+        if 'Fradrag' in fml:
+            fml = re.sub(reee, r"\1", fml, 0)
+
+        if get_float(fml) == 0.0:
+            logger.info("Special case for 8906 is applicable, but uncertain")
+            return True, True
+    else:
+        # I hope that this does not happen. It can be literally cancer to info
+        raise Exception(
+            "There is trouble with the match this might be because the index of kodekataloget is not correct. I "
+            "tried to look into [{}]".format(
+                columns["Specifikation"][index]))
+    return False, False
+
+
+def manglende_traek(index: int, columns: dict) -> (bool, bool):
+    """
+    Overført til konto (9993) can have nothing in beløb if there is an amount that has not been payed yet
+    """
+    logger.info("Try'n see if special case for 9993 is applicable")
+    # But sometimes it is okay
+    if "9990" in columns.get("Art"):
+        logger.info("Special case for 9993 is applicable, but uncertain")
+        return True, True
+    return False, False
+
+
+# The special cases for beløb, by the name used in the hooks of the kodekatalog
+beloeb_hooks = {
+    "skat_af": skat_af,
+    "manglende_traek": manglende_traek,
+}
+
 
-def special_cases_for_beloeb(code: str, index: int, columns: dict) -> (bool, bool):
+def special_cases_for_beloeb(ko: kodekatalog.Kode, index: int, columns: dict) -> (bool, bool):
     """
     Shitty generated tables, require shitty special cases.
     Sometimes we don't really know if we should insert an empty value or not
     Thus we have an "uncertain bool" that can be set
     and then later remove the value if it was not correct to remove it (by comparing the size to the size of art)
 
-    :param code: our current art number
+    :param ko: our current code from the kodekatalog
     :param index: the current index number
     :param columns: all of the colums
     :return: (bool, bool) first bool "insert empty" second bool "uncertain value"
      this should be handled manually in the code
     """
-    regex = r".*Skat af (.*)"
-
-    if code == "8906":
-        logger.info("Try'n see if special case for 8906 is applicable")
-        # The pay can have zero in beløb if there is no income
-        matches = re.search(regex, columns["Specifikation"][index])
-        if matches:
-            # Sometimes the table generates weirdly and Fradrag is actually AFTER Skat af.
-            # To combat this (I've only seen it once) so to combat this we are just checking if that is the case
-            fml = matches.group(1)
-            reee = r"(.*) Fradrag:.*"
-            if 'Fradrag' in fml:
-                fml = re.sub(reee, r"\1", fml, 0)
-
-            if get_float(fml) == 0.0:
-                logger.info("Special case for 8906 is applicable, but uncertain")
-                return True, True
-        else:
-            # I hope that this does not happen. It can be literally cancer to info
-            raise Exception(
-                "There is trouble with the match this might be because the index of kodekataloget is not correct. I "
-                "tried to look into [{}]".format(
-                    columns["Specifikation"][index]))
-
-    if code == "9993":
-        logger.info("Try'n see if special case for 9993 is applicable")
-        # Overført til konto can have nothing in beløb if there is an amount that has not been payed yet
-        # But sometimes it is okay
-        if "9990" in columns.get("Art"):
-            logger.info("Special case for 9993 is applicable, but uncertain")
-            return True, True
+    for hook in ko.hooks:
+        if hook in beloeb_hooks:
+            special_case, uncertain = beloeb_hooks[hook](index, columns)
+            if special_case:
+                return special_case, uncertain
     return False, False
 
 
-def parse(file: pathlib.Path) -> dict:
+def parse(file: pathlib.Path, engine: str = "camelot", katalog: kodekatalog.Katalog = None,
+          layouts: dict = None, strategies: dict = None, with_month: bool = True) -> dict:
     """
     Parse the file and return a list of dictionaries
     :param file: file location
+    :param engine: name of the extractor used to read the table, camelot is used if it fails
+    :param katalog: the kodekatalog to use, the built in one if None
+    :param layouts: where the table is for each layout of the payslip, extraction.LAYOUTS if None
+    :param strategies: if the second pass helped for each layout, see reconcile.Strategies.remembered
+    :param with_month: look for the month in the pdf, which is only needed when it is not in the filename
+    :return: dictionary with article numbers and there corresponding amounts,
+     the month of the payslip in "month" if it was found in the pdf, which is only there with with_month,
+     the layout, the strategy that aligned it and if the second pass helped in "strategy",
+     and how long each stage took in "timings", which should be removed before the result is cached
+    """
+    extractor = get_extractor(engine, layouts)
+    metrics = Metrics()
+    strategies = strategies or {}
+    stream = second_pass._get_name()
+    layout = None
+    columns, problems, error = None, [], None
+    try:
+        with metrics.timed("extract"):
+            cells, month = extractor.extract(file, with_month)
+        layout = "{}/{}".format(engine, extractor.layout)
+        columns, strategy, problems = reconciled(cells, katalog, metrics)
+    except kodekatalog.UnknownCodes:
+        # The codes are the same however the table is read
+        raise
+    except Exception as e:
+        error = e
+        # When camelot already looked on the whole page, the fallback would read the same table again
+        if not (extractor.name == fallback._get_name() and extractor.layout == "page"):
+            # The fallback looks for the table on the whole page, in case the table was not where the layout has it
+            logger.warning("The %s engine failed on %s (%s), falling back to %s on the whole page", engine,
+                           file.name, e, fallback._get_name())
+            try:
+                with metrics.timed("extract_fallback"):
+                    cells, month = fallback({}).extract(file, with_month)
+                columns, strategy, problems = reconciled(cells, katalog, metrics)
+            except kodekatalog.UnknownCodes:
+                raise
+            except Exception as e:
+                error = e
+    helped = None
+    failed = columns is None or _misaligned(problems)
+    if failed and strategies.get(layout, {}).get("second_pass") is False:
+        logger.info("Not trying %s on %s, as it did not help for the %s layout", stream, file.name, layout)
+    elif failed:
+        # The second pass reads the table by where the text is instead of the lines,
+        # which is slower but splits the rows of some tables the lines does not
+        logger.info("Could not align %s (%s), trying %s", file.name, error or problems[0].message, stream)
+        try:
+            with metrics.timed("extract_second_pass"):
+                cells, streamed_month = second_pass().extract(file, with_month)
+            streamed, _, streamed_problems = reconciled(cells, katalog, metrics)
+            helped = not _misaligned(streamed_problems)
+        except Exception as e:
+            logger.info("%s also failed on %s: %s", stream, file.name, e)
+            helped = False
+        if helped:
+            columns, month, strategy, problems = streamed, streamed_month, stream, streamed_problems
+    if columns is None:
+        raise error
+    for problem in problems:
+        logger.log(logging.WARNING if problem.kind == "number" else logging.INFO, "%s: %s", file.name,
+                   problem.message)
+    if with_month:
+        columns["month"] = month
+    columns["strategy"] = [layout, strategy, helped]
+    columns["timings"] = metrics.stages
+    return columns
+
+
+def _misaligned(problems: list) -> bool:
+    """
+    If reconcile.check found cells that are not numbers, which means the columns are not aligned right.
+    The balance is only advisory, so it does not count
+    """
+    return any(x.kind == "number" for x in problems)
+
+
+def reconciled(cells: list, katalog: kodekatalog.Katalog = None, metrics: Metrics = None) -> (dict, str, list):
+    """
+    Align the cells in the ways reconcile.hypotheses gives, until the default alignment has only numbers in the
+    number columns, or another alignment has no problems at all, as they go against the kodekatalog and
+    only having numbers is not enough to trust them. If none is, the first that aligned is used
+    :return: the columns from align, the strategy that aligned them, and the problems reconcile.check found
+    """
+    katalog = katalog or kodekatalog.KATALOG
+    metrics = metrics or Metrics()
+    aligned = None
+    error = None
+    for strategy, candidate, overrides in reconcile.hypotheses(cells, katalog):
+        if aligned is not None and strategy in ("compact", "single"):
+            # They are only for when nothing else aligns
+            break
+        try:
+            columns = align(candidate, katalog, metrics, overrides)
+        except kodekatalog.UnknownCodes:
+            raise
+        except Exception as e:
+            error = error or e
+            continue
+        with metrics.timed("reconcile"):
+            problems = reconcile.check(columns, katalog)
+        if not problems or (strategy == "default" and not _misaligned(problems)):
+            return columns, strategy, problems
+        if aligned is None:
+            aligned = columns, strategy, problems
+    if aligned is None:
+        raise error
+    return aligned
+
+
+def align(cells: list, katalog: kodekatalog.Katalog = None, metrics: Metrics = None, overrides: dict = None) -> dict:
+    """
+    Split the raw text of the table into columns, and align them so there is a value in every column for each Art
+    :param cells: the text of the Art, Specifikation, Antal, Sats and Beløb cells
+    :param katalog: the kodekatalog to use, the built in one if None
+    :param metrics: where to add the time of the split, align and special_cases stages
+    :param overrides: dict of (row, column) to if the row has a value in the Antal, Sats or Beløb column,
+     instead of what the kodekatalog and the special cases says. Used by reconcile to try other alignments
     :return: dictionary with article numbers and there corresponding amounts
     """
-    # Open PDF file and extract tables
-    tables = camelot.read_pdf(file.absolute().__str__())
+    katalog = katalog or kodekatalog.KATALOG
+    metrics = metrics or Metrics()
+    overrides = overrides or {}
+    start = time.perf_counter()
+    raw = {
+        "Specifikation": [x.strip() for x in cells[1].split("\n") if x.strip() != "" and x.strip() != "-"],
+        "Antal": cells[2].split("\n"),
+        "Sats": cells[3].split("\n"),
+        "Beløb": cells[4].split("\n")
+    }
     columns = {
-        "Art": [],
+        "Art": cells[0].split("\n"),
         "Specifikation": [],
         "Antal": [],
         "Sats": [],
         "Beløb": []
     }
-    # There is 2 tables. But we are only interested in the first one
-    table = tables[0].df
-
-    [columns["Art"].append(x) for x in table[0][1].split("\n")]
-    [columns["Specifikation"].append(x.strip()) for x in table[1][1].split("\n") if
-     x.strip() != "" and x.strip() != "-"]
-    [columns["Antal"].append(x) for x in table[2][1].split("\n")]
-    [columns["Sats"].append(x) for x in table[3][1].split("\n")]
-    [columns["Beløb"].append(x) for x in table[4][1].split("\n")]
+    # How far we have read into each of the raw columns
+    read = {column: 0 for column in raw}
+    # How many times each code has been seen so far
+    seen = {}
     perhaps = -1
+    # The special cases are timed on their own, and not as part of align
+    special = 0.0
 
-    logger.info("Parsing table with {} rows".format(len(columns["Art"])))
+    def take(column: str, amount: int = 1):
+        """
+        Move the next amount of values from the raw column to the aligned column, joined on a space
+        """
+        values = raw[column][read[column]:read[column] + amount]
+        read[column] += len(values)
+        if amount > 1:
+            columns[column].append(" ".join(values))
+        elif values:
+            columns[column].append(values[0])
 
-    # There is always an Art, or article number for each value. So we'll use this as the base for the rest of the values
-    for i, code in enumerate(columns["Art"]):
+    metrics.add("split", time.perf_counter() - start)
+    start = time.perf_counter()
+    logger.info("Parsing table with %s rows", len(columns["Art"]))
 
-        # There is the possiblity for 10.000 different codes (probably they can just add more if needed)
-        # I have not covered all of them.
-        # If this exception happens. Then you need to check the code in kodekataloget and add the code if needed
-        if code not in kodekatalog.kode:
-            raise Exception("Kode {} ikke fundet i kodekatalog.".format(code))
+    # There is the possiblity for 10.000 different codes (probably they can just add more if needed)
+    # I have not covered all of them.
+    # If this exception happens. Then you need to add the codes to the kodekatalog, or a file given with --kodekatalog
+    missing = katalog.missing(columns["Art"])
+    if missing:
+        raise kodekatalog.UnknownCodes(missing)
 
-        ko = kodekatalog.kode[code]
+    # There is always an Art, or article number for each value. So we'll use this as the base for the rest of the values
+    # Every row is handled once, by either taking the next value of each column or adding a blank value.
+    for i, code in enumerate(columns["Art"]):
+        ko = katalog[code]
+        has_antal, has_sats, has_beloeb = ko.mask
+        seen[code] = seen.get(code, 0) + 1
         # The following code is made to "equalize" the columns.
         # There needs to be an empty value in the rest of the columns for each value
         # when that is specified in the kodekatalog
@@ -106,36 +271,43 @@ def parse(file: pathlib.Path) -> dict:
         # Orlov u/løn og feriedage      06/04-2020     06/04-2020
         # When we split by \n, then that is seen as 3 rows.
         # This is cobatted manually in the kodekatalog by specifying that its length is 3
-        if ko.get("spec_amount") > 1:
-            logger.info("Joining {} rows for {}".format(ko.get("spec_amount"), code))
-            # Join the rows that is in spec_amount for specification
-            # Firstly we create a temporary object ss by joining the elements on a space
-            # Between our current index and + the spec_amount
-            ss = " ".join(columns["Specifikation"][i:i + ko["spec_amount"]])
-            # Then we delete the elements in the list
-            del columns["Specifikation"][i:i + ko["spec_amount"]]
-            # And we add the joined string to the list on the index
-            columns["Specifikation"].insert(i, ss)
-
-        if not ko.get("hasAntal"):
-            logger.info("Inserting blank value for antal with code {}".format(code))
-            # Add a blank value for the i into the exsisting list
-            columns["Antal"].insert(i, "")
-
-        if not ko.get("hasSats") or (code == "8721" and columns["Art"][:i + 1].count("8721") > 1) \
-                or (code == "8720" and columns["Art"][:i + 1].count("8720") > 1):
-            logger.info("Inserting blank value for sats with code {}".format(code))
-            # Add a blank value for the i into the exsisting list
-            columns["Sats"].insert(i, "")
-        special_cases, pp = special_cases_for_beloeb(code, i, columns)
-        if not ko.get("hasBeløb") or special_cases:
-            logger.info("Inserting blank value for beløb with code {}".format(code))
+        if ko.spec_amount > 1:
+            logger.info("Joining %s rows for %s", ko.spec_amount, code)
+        take("Specifikation", ko.spec_amount)
+
+        if not overrides.get((i, "Antal"), has_antal):
+            logger.info("Inserting blank value for antal with code %s", code)
+            columns["Antal"].append("")
+        else:
+            take("Antal")
+
+        if not overrides.get((i, "Sats"), has_sats and not ("sats_first_only" in ko.hooks and seen[code] > 1)):
+            logger.info("Inserting blank value for sats with code %s", code)
+            columns["Sats"].append("")
+        else:
+            take("Sats")
+        if (i, "Beløb") in overrides:
+            special_cases, pp = not overrides[(i, "Beløb")], False
+            has_beloeb = True
+        elif ko.hooks:
+            special_start = time.perf_counter()
+            special_cases, pp = special_cases_for_beloeb(ko, i, columns)
+            special += time.perf_counter() - special_start
+        else:
+            special_cases, pp = False, False
+        if not has_beloeb or special_cases:
+            logger.info("Inserting blank value for beløb with code %s", code)
             if pp:
                 perhaps = i
-            # Add a blank value for the i into the exsisting list
-            columns["Beløb"].insert(i, "")
-        # If not all all objects of the columns are the same length something went wrong
+            columns["Beløb"].append("")
+        else:
+            take("Beløb")
+
+    # Whatever is left in the raw columns did not belong to a row. It is kept, so the checks below catches it
+    for column, values in raw.items():
+        columns[column].extend(values[read[column]:])
 
+    # If not all all objects of the columns are the same length something went wrong
     if len(columns["Art"]) != len(columns["Specifikation"]):
         raise Exception(
             "Art [{}] og Specifikation [{}] ikke ens".format(len(columns["Art"]),
@@ -147,8 +319,8 @@ def parse(file: pathlib.Path) -> dict:
         raise Exception("Art [{}] og Sats [{}] ikke ens".format(len(columns["Art"]),
                                                                 len(columns["Sats"])))
     if len(columns["Art"]) != len(columns["Beløb"]):
-        logger.info("Different length for Art [{}] og Beløb [{}]".format(len(columns["Art"]),
-                                                                         len(columns["Beløb"])))
+        special_start = time.perf_counter()
+        logger.info("Different length for Art [%s] og Beløb [%s]", len(columns["Art"]), len(columns["Beløb"]))
         if perhaps != 0:
             logger.info("There is a chance that the difference in sizes in beløb and art is due to a "
                         "missing bad table generation. So we'll try'n remove it again, and see if "
@@ -162,5 +334,8 @@ def parse(file: pathlib.Path) -> dict:
         else:
             raise Exception("Art [{}] og Beløb [{}] ikke ens".format(len(columns["Art"]),
                                                                      len(columns["Beløb"])))
+        special += time.perf_counter() - special_start
 
+    metrics.add("align", time.perf_counter() - start - special)
+    metrics.add("special_cases", special)
     return columns
@@ -0,0 +1,165 @@
+import itertools
+import json
+import logging
+import pathlib
+from collections import namedtuple
+
+import kodekatalog
+import numparse
+
+logger = logging.getLogger(__name__)
+
+# kind is "number" when a cell is not a number, which means the alignment is wrong,
+# "balance" when the amounts does not add up to what is paid out, which could also be the payslip
+# or an informational code that is not marked with not_in_total yet,
+# or "unchecked" when there is nothing paid out to check against, because of manglende træk.
+# Only "number" is used to reject the default alignment, the others are only logged.
+# The other alignments go against the kodekatalog, so they are only used when there are no problems at all
+Problem = namedtuple("Problem", ["kind", "message"])
+
+# Overført til konto, what is paid out
+NET_CODE = "9993"
+# Manglende træk, the only reason 9993 can be without a Beløb
+MISSING_CODE = "9990"
+# How far the total can be from the Beløb of 9993, as the amounts are rounded
+TOLERANCE = 0.005
+# How many of the uncertain cells are tried in every combination, the rest is only tried one at a time
+MAX_COMBINATIONS = 4
+
+
+def check(columns: dict, katalog: kodekatalog.Katalog = None) -> list:
+    """
+    Check an aligned payslip against what should always be true for a payslip:
+    Every Antal, Sats and Beløb is a number, and the Beløb of every line item adds up to the Beløb of 9993,
+    which only can be empty when there is a 9990, and then the total can not be checked.
+    The codes with the not_in_total hook in the kodekatalog are not counted in the total.
+    The balance is advisory, as not every informational code is known to have the hook
+    :param columns: the columns from parser.align
+    :return: list of the problems, empty if there are none
+    """
+    katalog = katalog or kodekatalog.KATALOG
+    problems = []
+    numbers = {}
+    for column in ("Antal", "Sats", "Beløb"):
+        numbers[column], malformed = numparse.parse_column(columns[column], columns["Art"], column)
+        problems.extend(Problem("number", "{} of {} in row {} is not a number: {!r}".format(
+            cell.column, cell.code, cell.row, cell.text)) for cell in malformed)
+    if NET_CODE in columns["Art"] and not problems:
+        net = numbers["Beløb"][columns["Art"].index(NET_CODE)]
+        if net is None and MISSING_CODE not in columns["Art"]:
+            problems.append(Problem("balance", "{} has no Beløb, but there is no {}".format(NET_CODE, MISSING_CODE)))
+        elif net is None:
+            problems.append(Problem("unchecked", "{} has no Beløb, so the total can not be checked".format(NET_CODE)))
+        else:
+            total = sum(amount for code, amount in zip(columns["Art"], numbers["Beløb"])
+                        if amount is not None and code != NET_CODE and "not_in_total" not in katalog[code].hooks)
+            if abs(total - net) > TOLERANCE:
+                problems.append(Problem("balance", "The line items adds up to {:.2f}, but {} is {:.2f}".format(
+                    total, NET_CODE, net)))
+    return problems
+
+
+def _uncertain(cells: list, katalog: kodekatalog.Katalog) -> list:
+    """
+    The cells where the special cases decides if there is a value
+    :return: list of (row, column)
+    """
+    uncertain = []
+    seen = set()
+    for row, code in enumerate(cells[0].split("\n")):
+        hooks = katalog[code].hooks if code in katalog else ()
+        if "skat_af" in hooks or "manglende_traek" in hooks:
+            uncertain.append((row, "Beløb"))
+        if "sats_first_only" in hooks and code in seen:
+            uncertain.append((row, "Sats"))
+        seen.add(code)
+    return uncertain
+
+
+def _compact(cells: list) -> list:
+    """
+    The cells without the empty lines in the number columns, which camelot sometimes adds
+    """
+    return cells[:2] + ["\n".join(x for x in cell.split("\n") if x.strip()) for cell in cells[2:]]
+
+
+def hypotheses(cells: list, katalog: kodekatalog.Katalog = None):
+    """
+    The ways to align the cells, from the most to the least likely, as the cheapest way to find an alignment
+    where check finds no cells that are not numbers is to try them in order. The order is always the same,
+    so which alignment is used only depends on the cells. Each is given to parser.align,
+    and is one of the strategies:
+    default: what the kodekatalog and the special cases says
+    uncertain: every combination of a value or not in the cells where the special cases are uncertain
+    compact: the default without the empty lines in the number columns
+    single: each of the Antal, Sats and Beløb cells of each row, with a value when there should be none
+     and the other way around
+    :return: generator of (strategy, cells, overrides)
+    """
+    katalog = katalog or kodekatalog.KATALOG
+    for strategy in ("default", "uncertain", "compact", "single"):
+        if strategy == "default":
+            yield strategy, cells, {}
+        elif strategy == "uncertain":
+            uncertain = _uncertain(cells, katalog)
+            combined = uncertain[:MAX_COMBINATIONS]
+            for values in itertools.product((True, False), repeat=len(combined)):
+                yield strategy, cells, dict(zip(combined, values))
+            for cell in uncertain[MAX_COMBINATIONS:]:
+                for value in (True, False):
+                    yield strategy, cells, {cell: value}
+        elif strategy == "compact":
+            compacted = _compact(cells)
+            if compacted != cells:
+                yield strategy, compacted, {}
+        elif strategy == "single":
+            for row, code in enumerate(cells[0].split("\n")):
+                if code not in katalog:
+                    continue
+                for column, has in zip(("Antal", "Sats", "Beløb"), katalog[code].mask):
+                    yield strategy, cells, {(row, column): not has}
+
+
+class Strategies:
+    """
+    Remembers for each layout if the second pass did not help, so it is not tried again.
+    What is recorded is only used from the next run, as the pdfs are parsed in parallel,
+    and the result should not depend on which of them finished first.
+    It is saved as json, so it is kept between runs
+    """
+
+    def __init__(self, filename: pathlib.Path = None):
+        """
+        :param filename: where to save the strategies, or None to only keep them while running
+        """
+        self.filename = filename
+        # layout to {"second_pass": False if the second pass did not help}, as it was when loaded
+        self.remembered = {}
+        # What was recorded since, which is saved with the rest
+        self.recorded = {}
+        if filename is not None:
+            try:
+                with open(filename) as f:
+                    self.remembered = {layout: x for layout, x in json.load(f).items() if isinstance(x, dict)}
+            except (OSError, ValueError, AttributeError):
+                pass
+
+    def record(self, layout: str, second_pass: bool = None):
+        """
+        :param second_pass: if the second pass helped, or None if it was not tried
+        """
+        if layout is None or second_pass is None:
+            return
+        if second_pass is False and self.remembered.get(layout, {}).get("second_pass") is not False \
+                and layout not in self.recorded:
+            logger.info("Not trying the second pass for the %s layout from the next run, as it did not help", layout)
+        self.recorded.setdefault(layout, {})["second_pass"] = second_pass
+
+    def save(self):
+        if self.filename is None:
+            return
+        remembered = {layout: dict(x) for layout, x in self.remembered.items()}
+        for layout, x in self.recorded.items():
+            remembered.setdefault(layout, {}).update(x)
+        with open(self.filename, 'w') as f:
+            json.dump(remembered, f, indent=2)
@@ -0,0 +1,271 @@
+import argparse
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import pathlib
+import tempfile
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import parse_qs, urlsplit
+
+import aggregate
+import kodekatalog
+from cache import ParseCache, versioned_key
+from extraction import extractors, load_layouts, warm_up
+from parser import parse
+
+logger = logging.getLogger(__name__)
+
+args = argparse.ArgumentParser("Parse payslips over http")
+args.add_argument("--host", help="The address to listen on", type=str, default="127.0.0.1")
+args.add_argument("-p", "--port", help="The port to listen on", type=int, default=8080)
+args.add_argument("-i", "--input", help="Only pdfs in this directory can be parsed by their path, "
+                                        "pdfs anywhere else has to be uploaded", type=str, default=".")
+args.add_argument("-j", "--jobs", help="Number of pdfs to parse in parallel", type=int, default=os.cpu_count() or 1)
+args.add_argument("-q", "--queue", help="How many requests can wait for a free process, "
+                                        "before new requests are told to try again later", type=int, default=32)
+args.add_argument("--max-upload", help="Max size of an uploaded pdf in MB", type=float, default=20)
+args.add_argument("-e", "--engine", help="How to read the table in the pdfs, camelot is used if the engine fails",
+                  choices=[x._get_name() for x in extractors], default="camelot")
+args.add_argument("-k", "--kodekatalog", help="Json file with codes to add to or replace in the kodekatalog", type=str)
+args.add_argument("--layouts", help="Json file with the page and area of the table for each payslip layout, "
+                                    "so camelot only has to look there instead of on the whole page", type=str)
+args.add_argument("--cache-dir", help="Where to cache parsed pdfs", type=str,
+                  default=str(pathlib.Path.home() / ".cache" / "paycheckparser"))
+args.add_argument("--no-cache", help="Do not read or write the cache on disk", action="store_true")
+args.add_argument("--memory-cache", help="How many parsed pdfs to keep in memory", type=int, default=1024)
+args.add_argument("-v", "--verbose", help="The log level", choices=["DEBUG", "INFO", "WARNING", "ERROR"],
+                  default="INFO")
+
+REASONS = {200: "OK", 400: "Bad Request", 403: "Forbidden", 404: "Not Found", 405: "Method Not Allowed",
+           413: "Payload Too Large", 422: "Unprocessable Entity", 500: "Internal Server Error",
+           503: "Service Unavailable"}
+
+
+class HttpError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+def summarize(columns: dict) -> dict:
+    """
+    The line items and stocks of a single parsed payslip, the same way main.py calculates them for the outputs
+    :param columns: the columns returned by parse
+    :return: the month, the columns and the stocks
+    """
+    month = columns.get("month")
+    items = {x: columns[x] for x in ("Art", "Specifikation", "Antal", "Sats", "Beløb")}
+    table = aggregate.to_table({month or "": items})
+    stocks = aggregate.stocks(table, [month or ""])
+    return {
+        "month": month,
+        "columns": items,
+        "stocks": {x: stocks[x].iloc[0] for x in aggregate.STOCK_COLUMNS},
+    }
+
+
+class Server:
+    """
+    Parses the pdfs in a pool with a process for each job. At most jobs + queue requests are parsing or waiting,
+    the rest gets 503, so a burst of requests can not make the server use all the memory.
+    The same pdf is only parsed once, as results are cached by the hash of the content,
+    and requests for a pdf that is already being parsed wait for that instead.
+    """
+
+    def __init__(self, argz, executor: ProcessPoolExecutor, cache: ParseCache, katalog: kodekatalog.Katalog,
+                 layouts: dict):
+        self.argz = argz
+        self.executor = executor
+        self.cache = cache
+        self.katalog = katalog
+        self.layouts = layouts
+        self.root = pathlib.Path(argz.input).resolve()
+        self.slots = asyncio.Semaphore(argz.jobs)
+        self.waiting = 0
+        # key to the summary of the pdf, the least recently used first
+        self.memory = OrderedDict()
+        # key to the future of a pdf being parsed
+        self.parsing = {}
+
+    def _remember(self, key: str, summary: dict):
+        self.memory[key] = summary
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.argz.memory_cache:
+            self.memory.popitem(last=False)
+
+    async def _parse(self, pdf: pathlib.Path) -> dict:
+        loop = asyncio.get_running_loop()
+        async with self.slots:
+            columns = await loop.run_in_executor(self.executor, parse, pdf, self.argz.engine, self.katalog,
+                                                 self.layouts)
+        columns.pop("timings", None)
+        columns.pop("strategy", None)
+        return columns
+
+    async def _summary(self, key: str, pdf: pathlib.Path) -> (dict, bool):
+        """
+        :return: the summary of the pdf, and if it was cached
+        """
+        if key in self.memory:
+            self.memory.move_to_end(key)
+            return self.memory[key], True
+        if key in self.parsing:
+            return await asyncio.shield(self.parsing[key]), True
+        if self.waiting >= self.argz.jobs + self.argz.queue:
+            raise HttpError(503, "Too many pdfs are being parsed, try again later")
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.parsing[key] = future
+        self.waiting += 1
+        try:
+            cached = True
+            columns = self.cache.get(key) if self.cache else None
+            if columns is not None and "month" not in columns:
+                # It was parsed by main.py while the month was in the filename, so the month was not looked for
+                columns = None
+            if columns is None:
+                cached = False
+                columns = await self._parse(pdf)
+                if self.cache:
+                    self.cache.put(key, columns)
+            # Aggregating uses pandas, which would block the other requests
+            summary = await loop.run_in_executor(None, summarize, columns)
+            self._remember(key, summary)
+            future.set_result(summary)
+            return summary, cached
+        except Exception as e:
+            future.set_exception(e)
+            # Retrieved here, so asyncio does not warn about it when no other request waited for it
+            future.exception()
+            raise
+        finally:
+            self.waiting -= 1
+            del self.parsing[key]
+
+    def _key(self, data: bytes) -> str:
+        return versioned_key(hashlib.sha256(data), self.katalog.version, self.argz.engine, self.layouts)
+
+    def _resolve(self, path: str) -> pathlib.Path:
+        pdf = pathlib.Path(path)
+        pdf = (pdf if pdf.is_absolute() else self.root / pdf).resolve()
+        if pdf != self.root and self.root not in pdf.parents:
+            raise HttpError(403, "{} is not in {}".format(path, self.root))
+        if not pdf.is_file():
+            raise HttpError(404, "{} does not exist".format(path))
+        return pdf
+
+    async def parse_path(self, path: str) -> (dict, bool):
+        pdf = self._resolve(path)
+        data = await asyncio.get_running_loop().run_in_executor(None, pdf.read_bytes)
+        # The same key as ParseCache.key gives, so pdfs parsed by main.py are found in the cache
+        return await self._summary(self._key(data), pdf)
+
+    async def parse_upload(self, data: bytes) -> (dict, bool):
+        if not data.startswith(b"%PDF"):
+            raise HttpError(400, "The body is not a pdf")
+        key = self._key(data)
+        if key in self.memory or key in self.parsing:
+            return await self._summary(key, None)
+        # The engines reads the pdf from a file, so it is saved while it is parsed
+        with tempfile.TemporaryDirectory() as directory:
+            pdf = pathlib.Path(directory) / "upload.pdf"
+            pdf.write_bytes(data)
+            return await self._summary(key, pdf)
+
+    async def route(self, method: str, target: str, headers: dict, body: bytes) -> (int, dict):
+        url = urlsplit(target)
+        query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        if url.path == "/health":
+            return 200, {"status": "ok", "parsing": self.waiting, "cached": len(self.memory)}
+        if url.path != "/parse":
+            raise HttpError(404, "Unknown path {}, use /parse or /health".format(url.path))
+        if method == "GET" and "path" in query:
+            summary, cached = await self.parse_path(query["path"])
+        elif method == "POST" and headers.get("content-type", "").startswith("application/json"):
+            try:
+                path = json.loads(body)["path"]
+            except (ValueError, KeyError, TypeError):
+                raise HttpError(400, 'The body should be {"path": "the pdf"}')
+            summary, cached = await self.parse_path(path)
+        elif method == "POST":
+            summary, cached = await self.parse_upload(body)
+        else:
+            raise HttpError(405, "Use GET /parse?path=the pdf, or POST the pdf or its path to /parse")
+        if summary["month"] is None and "month" in query:
+            summary = dict(summary, month=query["month"])
+        return 200, dict(summary, cached=cached)
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        status, result = 500, {"error": "Internal server error"}
+        try:
+            request = (await reader.readline()).decode("latin-1").split()
+            if len(request) != 3:
+                raise HttpError(400, "Not a http request")
+            method, target, _ = request
+            headers = {}
+            while True:
+                line = (await reader.readline()).decode("latin-1").strip()
+                if not line:
+                    break
+                name, _, value = line.partition(":")
+                headers[name.strip().lower()] = value.strip()
+            length = int(headers.get("content-length", 0))
+            if length > self.argz.max_upload * 1024 * 1024:
+                raise HttpError(413, "The pdf is bigger than {} MB".format(self.argz.max_upload))
+            body = await reader.readexactly(length) if length else b""
+            status, result = await self.route(method.upper(), target, headers, body)
+        except HttpError as e:
+            status, result = e.status, {"error": str(e)}
+        except kodekatalog.UnknownCodes as e:
+            status, result = 422, {"error": str(e), "codes": e.codes}
+        except (ValueError, asyncio.IncompleteReadError) as e:
+            status, result = 400, {"error": str(e)}
+        except Exception as e:
+            logger.exception("Failed to handle a request")
+            status, result = 422, {"error": str(e)}
+        body = json.dumps(result, ensure_ascii=False).encode("utf-8")
+        head = ["HTTP/1.1 {} {}".format(status, REASONS.get(status, "")),
+                "Content-Type: application/json; charset=utf-8",
+                "Content-Length: {}".format(len(body)),
+                "Connection: close"]
+        if status == 503:
+            head.append("Retry-After: 1")
+        try:
+            writer.write(("\r\n".join(head) + "\r\n\r\n").encode("latin-1") + body)
+            await writer.drain()
+            writer.close()
+            await writer.wait_closed()
+        except ConnectionError:
+            pass
+
+
+async def serve(argz):
+    katalog = kodekatalog.load(argz.kodekatalog)
+    layouts = load_layouts(argz.layouts)
+    cache = None if argz.no_cache else ParseCache(argz.cache_dir, katalog_version=katalog.version,
+                                                      engine=argz.engine, layouts=layouts)
+    # The processes imports the engine when they start, and this process imports pandas for the stocks
+    warm_up(argz.engine)
+    import pandas  # noqa: F401
+    with ProcessPoolExecutor(max_workers=argz.jobs, initializer=warm_up, initargs=(argz.engine,)) as executor:
+        server = Server(argz, executor, cache, katalog, layouts)
+        http = await asyncio.start_server(server.handle, argz.host, argz.port)
+        logger.info("Listening on http://%s:%s", argz.host, argz.port)
+        async with http:
+            await http.serve_forever()
+
+
+def main():
+    argz = args.parse_args()
+    logging.basicConfig(level=argz.verbose, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    try:
+        asyncio.run(serve(argz))
+    except KeyboardInterrupt:
+        logger.info("Stopped")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,218 @@
+import argparse
+import json
+import logging
+import pathlib
+import sqlite3
+import time
+
+import kodekatalog
+import numparse
+from cache import file_hash
+from parser import PARSER_VERSION
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    hash TEXT PRIMARY KEY,
+    path TEXT NOT NULL,
+    employee TEXT NOT NULL,
+    month TEXT NOT NULL,
+    parser_version TEXT NOT NULL,
+    katalog_version TEXT NOT NULL,
+    added REAL NOT NULL,
+    UNIQUE (employee, month)
+);
+CREATE TABLE IF NOT EXISTS line_items (
+    file_hash TEXT NOT NULL REFERENCES files (hash) ON DELETE CASCADE,
+    employee TEXT NOT NULL,
+    month TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    art TEXT NOT NULL,
+    specifikation TEXT NOT NULL,
+    antal REAL,
+    sats REAL,
+    beloeb REAL,
+    PRIMARY KEY (file_hash, position)
+);
+CREATE INDEX IF NOT EXISTS line_items_month_art ON line_items (month, art);
+"""
+
+# The same codes as aggregate.stocks uses, Antal of 5092 is the employer matched and Beløb of 9221 the additional
+STOCKS_QUERY = """
+SELECT employee, month,
+       COALESCE(SUM(CASE WHEN art = '5092' THEN antal END), 0.0) AS employers_matched_contribution,
+       0.0 - COALESCE(SUM(CASE WHEN art = '9221' THEN beloeb END), 0.0) AS additional_contribution
+FROM line_items
+WHERE art IN ('5092', '9221') {where}
+GROUP BY employee, month
+"""
+
+
+def _numbers(columns: dict, column: str) -> list:
+    """
+    The same as aggregate.parse_numbers, None when the cell is empty and 0.0 when it can not be parsed
+    """
+    numbers, malformed = numparse.parse_column(columns[column], columns["Art"], column, malformed_value=0.0)
+    for cell in malformed:
+        logger.warning("%s of %s in row %s is not a number: %r", cell.column, cell.code, cell.row, cell.text)
+    return numbers
+
+
+class Store:
+    """
+    Every line item of every payslip in a sqlite database, where the codes that are there more than once in a month
+    are all kept, unlike in the nested result of main.py.
+    A pdf is stored by the hash of its content, so adding it again is skipped, and a corrected payslip replaces
+    the one for the same employee and month
+    """
+
+    def __init__(self, filename: str, katalog_version: str = kodekatalog.VERSION):
+        self.filename = filename
+        self.katalog_version = katalog_version
+        self.connection = sqlite3.connect(filename)
+        self.connection.execute("PRAGMA foreign_keys = ON")
+        self.connection.execute("PRAGMA journal_mode = WAL")
+        self.connection.executescript(SCHEMA)
+
+    def stored(self, digest: str) -> bool:
+        """
+        :return: if the pdf is stored, parsed with the current parser and kodekatalog
+        """
+        row = self.connection.execute("SELECT parser_version, katalog_version FROM files WHERE hash = ?",
+                                      (digest,)).fetchone()
+        return row == (PARSER_VERSION, self.katalog_version)
+
+    def add_all(self, parsed: list):
+        """
+        Add the payslips in one transaction
+        :param parsed: list of (employee, month, pdf, columns), where columns are returned by parser.parse
+        """
+        added = 0
+        with self.connection:
+            for employee, month, pdf, columns in parsed:
+                digest = file_hash(pdf)
+                if self.stored(digest):
+                    continue
+                employee = employee or ""
+                self.connection.execute("DELETE FROM files WHERE (employee = ? AND month = ?) OR hash = ?",
+                                        (employee, month, digest))
+                self.connection.execute(
+                    "INSERT INTO files (hash, path, employee, month, parser_version, katalog_version, added) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (digest, str(pdf), employee, month, PARSER_VERSION, self.katalog_version, time.time()))
+                rows = zip(columns["Art"], columns["Specifikation"], _numbers(columns, "Antal"),
+                           _numbers(columns, "Sats"), _numbers(columns, "Beløb"))
+                self.connection.executemany(
+                    "INSERT INTO line_items VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    ((digest, employee, month, position, art, spec or "", antal, sats, beloeb)
+                     for position, (art, spec, antal, sats, beloeb) in enumerate(rows)))
+                added += 1
+        logger.info("Stored %s of %s payslips in %s", added, len(parsed), self.filename)
+
+    def query(self, sql: str, parameters=()) -> (list, list):
+        """
+        :return: the names of the columns, and the rows
+        """
+        cursor = self.connection.execute(sql, parameters)
+        return [x[0] for x in cursor.description or ()], cursor.fetchall()
+
+    def totals(self, by: str = "year", codes: list = None, employee: str = None) -> (list, list):
+        """
+        Sum of Antal and Beløb for each code, per year or month
+        """
+        period = "substr(month, 1, 4)" if by == "year" else "month"
+        where, parameters = self._filter(codes, employee)
+        return self.query(
+            "SELECT employee, {period} AS {by}, art, COUNT(*) AS rows, SUM(antal) AS antal, SUM(beloeb) AS beloeb "
+            "FROM line_items {where} GROUP BY employee, {by}, art ORDER BY employee, {by}, art".format(
+                period=period, by=by, where="WHERE " + where if where else ""), parameters)
+
+    def stocks(self, employee: str = None) -> (list, list):
+        """
+        The stock contributions of each month
+        """
+        where, parameters = self._filter(None, employee)
+        return self.query(
+            "SELECT employee, month, employers_matched_contribution, additional_contribution, "
+            "employers_matched_contribution + additional_contribution AS stocks_total "
+            "FROM ({}) ORDER BY employee, month".format(STOCKS_QUERY.format(where="AND " + where if where else "")),
+            parameters)
+
+    def items(self, codes: list = None, employee: str = None, months: (str, str) = None) -> (list, list):
+        """
+        Every line item, optionally only for some codes and the months from months[0] to months[1]
+        """
+        where, parameters = self._filter(codes, employee, months)
+        return self.query(
+            "SELECT employee, month, art, specifikation, antal, sats, beloeb FROM line_items {} "
+            "ORDER BY employee, month, position".format("WHERE " + where if where else ""), parameters)
+
+    @staticmethod
+    def _filter(codes: list = None, employee: str = None, months: (str, str) = None) -> (str, list):
+        conditions = []
+        parameters = []
+        if months:
+            conditions.append("month BETWEEN ? AND ?")
+            parameters.extend(months)
+        if codes:
+            conditions.append("art IN ({})".format(", ".join("?" * len(codes))))
+            parameters.extend(codes)
+        if employee is not None:
+            conditions.append("employee = ?")
+            parameters.append(employee)
+        return " AND ".join(conditions), parameters
+
+    def close(self):
+        self.connection.close()
+
+
+args = argparse.ArgumentParser("Query the line items stored with main.py --db")
+args.add_argument("db", help="The sqlite database", type=str)
+args.add_argument("--employee", help="Only this employee, with --batch", type=str)
+args.add_argument("--json", help="Print the rows as json", action="store_true")
+commands = args.add_subparsers(dest="command", required=True)
+command = commands.add_parser("totals", help="Sum of Antal and Beløb for each code")
+command.add_argument("--by", choices=["year", "month"], default="year")
+command.add_argument("-a", "--art", help="Only these codes", nargs="+")
+commands.add_parser("stocks", help="The stock contributions of each month")
+command = commands.add_parser("items", help="Every line item")
+command.add_argument("-a", "--art", help="Only these codes", nargs="+")
+command.add_argument("--from", help="The first month, as YYYY-MM", dest="first", type=str, default="0000-00")
+command.add_argument("--to", help="The last month, as YYYY-MM", dest="last", type=str, default="9999-99")
+command = commands.add_parser("sql", help="Run a query, eg. \"SELECT art, COUNT(*) FROM line_items GROUP BY art\"")
+command.add_argument("query", type=str)
+
+
+def print_rows(names: list, rows: list, as_json: bool = False):
+    if as_json:
+        print(json.dumps([dict(zip(names, row)) for row in rows], ensure_ascii=False, indent=2))
+        return
+    cells = [names] + [["" if x is None else "{:.2f}".format(x) if isinstance(x, float) else str(x) for x in row]
+                       for row in rows]
+    widths = [max(len(row[i]) for row in cells) for i in range(len(names))]
+    for row in cells:
+        print("  ".join(x.rjust(w) if i else x.ljust(w) for i, (x, w) in enumerate(zip(row, widths))))
+
+
+def main():
+    argz = args.parse_args()
+    if not pathlib.Path(argz.db).exists():
+        raise Exception("{} does not exist, make it with main.py --db".format(argz.db))
+    store = Store(argz.db)
+    try:
+        if argz.command == "totals":
+            names, rows = store.totals(argz.by, argz.art, argz.employee)
+        elif argz.command == "stocks":
+            names, rows = store.stocks(argz.employee)
+        elif argz.command == "items":
+            names, rows = store.items(argz.art, argz.employee, (argz.first, argz.last))
+        else:
+            names, rows = store.query(argz.query)
+    finally:
+        store.close()
+    print_rows(names, rows, argz.json)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,167 @@
+import pathlib
+import random
+
+import kodekatalog
+from extraction import COLUMNS, Text
+
+# The x position in points of the lines between the columns, the same as the column ranges of the text engine
+COLUMN_LINES = [30, 75, 300, 385, 470, 565]
+LINE_HEIGHT = 12
+TABLE_TOP = 740
+FONT_SIZE = 9
+# How many characters fits in the specifikation column
+SPEC_WIDTH = 36
+
+MONTHS = ["januar", "februar", "marts", "april", "maj", "juni", "juli", "august", "september", "oktober",
+          "november", "december"]
+
+
+def dk(value: float) -> str:
+    """
+    Format a number the way the payslips does, eg. 1.234,56
+    """
+    return "{:,.2f}".format(value).replace(",", "_").replace(".", ",").replace("_", ".")
+
+
+def payslip(rng: random.Random, rows: int = 12) -> list:
+    """
+    Make the line items of a random payslip, using the codes of the kodekatalog
+    Both special cases of 8906 and 9993, with and without a beløb, and repeated 8720/8721 are generated.
+    The Beløb of 9993 is the sum of the other amounts, like on a real payslip
+    :param rng: the random generator
+    :param rows: about how many line items there should be
+    :return: list of (code, specifikation lines, antal, sats, beløb) where the values are "" when not there
+    """
+    codes = ["1001", "5092", "9221"]
+    # not_in_total does not change how the code is aligned
+    normal = [x for x in kodekatalog.kode if set(kodekatalog.kode[x].get("hooks", ())) <= {"not_in_total"}
+              and x not in codes]
+    codes += rng.sample(normal, min(max(rows - 6, 0), len(normal)))
+    codes += rng.choice([["8720", "8721"], ["8720", "8720", "8721", "8721"]])
+    no_income = rng.random() < 0.1
+    missing = rng.random() < 0.1
+    codes += ["8906"] + (["9990"] if missing else []) + ["9993"]
+
+    items = []
+    seen = set()
+    # The Beløb of 9993 is what the other amounts adds up to, as reconcile.check expects
+    total = 0.0
+    for code in codes:
+        ko = kodekatalog.kode[code]
+        # Long names are cut, so they stay inside the specifikation column
+        spec = [ko["spec"][:SPEC_WIDTH].strip()]
+        spec += ["{:02d}/{:02d}-2020".format(rng.randint(1, 28), rng.randint(1, 12)) for _ in range(ko["spec_amount"] - 1)]
+        antal = dk(rng.uniform(1, 200)) if ko["hasAntal"] else ""
+        # 8720 and 8721 only has a sats the first time
+        sats = dk(rng.uniform(1, 500)) if ko["hasSats"] and not (code in ("8720", "8721") and code in seen) else ""
+        amount = round(rng.uniform(-20000, 40000), 2) if ko["hasBeløb"] else 0.0
+        beloeb = dk(amount) if ko["hasBeløb"] else ""
+        if code == "8906":
+            skat = 0 if no_income else rng.uniform(1000, 15000)
+            spec = ["A-indk", "Skat af {}".format(dk(skat)), "Fradrag: {}".format(dk(rng.uniform(1000, 5000)))]
+            beloeb = "" if no_income else beloeb
+        if code == "9993":
+            beloeb = "" if missing else dk(total)
+        elif beloeb and "not_in_total" not in ko.get("hooks", ()):
+            total += amount
+        seen.add(code)
+        items.append((code, spec, antal, sats, beloeb))
+    return items
+
+
+def cells(items: list) -> list:
+    """
+    The raw text of each column, as the extractors gives it to parser.align
+    """
+    columns = [[], [], [], [], []]
+    for code, spec, antal, sats, beloeb in items:
+        columns[0].append(code)
+        columns[1].extend(spec)
+        for i, value in ((2, antal), (3, sats), (4, beloeb)):
+            if value:
+                columns[i].append(value)
+    return ["\n".join(x) for x in columns]
+
+
+def _escape(text: str) -> bytes:
+    return text.encode("cp1252").replace(b"\\", b"\\\\").replace(b"(", b"\\(").replace(b")", b"\\)")
+
+
+def _text(x: float, y: float, text: str) -> bytes:
+    return b"BT /F1 %d Tf %.2f %.2f Td (" % (FONT_SIZE, x, y) + _escape(text) + b") Tj ET\n"
+
+
+def render(items: list, month: int, year: int) -> bytes:
+    """
+    Draw the payslip as a single page pdf, with the line items in a table with ruling lines
+    :return: the pdf
+    """
+    ops = [_text(30, 800, "Lønseddel {} {}".format(MONTHS[month - 1], year)),
+           _text(30, 785, "Lønperiode 01.{:02d}.{} - 28.{:02d}.{}".format(month, year, month, year))]
+    header_bottom = TABLE_TOP - 18
+    for x, name in zip(COLUMN_LINES, COLUMNS):
+        ops.append(_text(x + 4, header_bottom + 5, name))
+
+    # Every line item starts on its own line, and the extra specifikation lines go below it
+    y = header_bottom - LINE_HEIGHT
+    for code, spec, antal, sats, beloeb in items:
+        ops.append(_text(COLUMN_LINES[0] + 4, y, code))
+        for x, value in ((COLUMN_LINES[2], antal), (COLUMN_LINES[3], sats), (COLUMN_LINES[4], beloeb)):
+            if value:
+                ops.append(_text(x + 4, y, value))
+        for line in spec:
+            ops.append(_text(COLUMN_LINES[1] + 4, y, line))
+            y -= LINE_HEIGHT
+    bottom = y + LINE_HEIGHT - 6
+
+    left, right = COLUMN_LINES[0], COLUMN_LINES[-1]
+    ops.append(b"0.5 w\n")
+    for line_y in (TABLE_TOP, header_bottom, bottom):
+        ops.append(b"%.2f %.2f m %.2f %.2f l S\n" % (left, line_y, right, line_y))
+    for x in COLUMN_LINES:
+        ops.append(b"%.2f %.2f m %.2f %.2f l S\n" % (x, TABLE_TOP, x, bottom))
+    content = b"".join(ops)
+
+    title = _escape("Lønseddel {} {}".format(MONTHS[month - 1], year))
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        b"<< /Type /Pages /Kids [3 0 R] /Count 1 >>",
+        b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] /Resources << /Font << /F1 4 0 R >> >> "
+        b"/Contents 5 0 R >>",
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>",
+        b"<< /Length %d >>\nstream\n" % len(content) + content + b"endstream",
+        b"<< /Title (" + title + b") >>",
+    ]
+    pdf = b"%PDF-1.4\n"
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(pdf))
+        pdf += b"%d 0 obj\n" % number + body + b"\nendobj\n"
+    xref = len(pdf)
+    pdf += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    pdf += b"".join(b"%010d 00000 n \n" % x for x in offsets)
+    pdf += b"trailer\n<< /Size %d /Root 1 0 R /Info 6 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    return pdf
+
+
+def generate(directory: pathlib.Path, amount: int, seed: int = 0) -> dict:
+    """
+    Write amount synthetic payslips to directory, named like the real ones so the month is found from the name
+    :return: dict of the pdf to its month as YYYY-MM and the cells that it should be extracted as
+    """
+    directory = pathlib.Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    rng = random.Random(seed)
+    expected = {}
+    for i in range(amount):
+        # One payslip a month, so there is a unique month for each of them
+        year, month = 1000 + i // 12, i % 12 + 1
+        items = payslip(rng)
+        pdf = directory / "Lønseddel - loenseddel{}{}.PDF".format(MONTHS[month - 1], year)
+        pdf.write_bytes(render(items, month, year))
+        expected[pdf] = ("{}-{:02d}".format(year, month), cells(items))
+    return expected
+
+
+# Check that the layout matches what the text engine expects
+assert [Text.column_ranges[x][0] for x in COLUMNS[1:]] == COLUMN_LINES[1:5]
@@ -0,0 +1,6 @@
+import pathlib
+import sys
+
+# The modules are in the root of the repository, and are imported like main.py imports them
+ROOT = pathlib.Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
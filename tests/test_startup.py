@@ -0,0 +1,72 @@
+import json
+import subprocess
+import sys
+
+import outtu
+from conftest import ROOT
+
+# The dependencies that are slow to import, and should only be imported when a pdf is extracted or aggregated
+HEAVY = ["camelot", "pandas"]
+
+HELP = """
+import runpy
+sys.argv = ["main.py"] + ARGV
+try:
+    runpy.run_path("main.py", run_name="__main__")
+except SystemExit:
+    pass
+"""
+
+WRITERS = """
+import importlib.util
+import tempfile
+import outtu
+values = {
+    "1001": {"Specifikation": "Løn", "Antal": 160.33, "Sats": 200.0, "Beløb": 32066.0},
+    "Employers_Matched_Contribution": 1.0, "Additional_contribution": 2.0, "Stocks_total": 3.0,
+}
+# The writers that needs a package to write, and where it is not installed, are skipped
+needs = {"YAML": "yaml", "Parquet": "pyarrow"}
+with tempfile.TemporaryDirectory() as directory:
+    for out in outtu.out_functions:
+        if out._get_name() not in ARGV:
+            continue
+        if out._get_name() in needs and importlib.util.find_spec(needs[out._get_name()]) is None:
+            continue
+        writer = out("dk")
+        try:
+            writer.save({"2020-01": values}, "{}/out.{}".format(directory, writer.name))
+        except NotImplementedError:
+            pass
+"""
+
+
+def imported(code: str, argv: list = (), heavy: list = HEAVY) -> list:
+    """
+    Run code in a new interpreter
+    :param argv: given to the code as ARGV
+    :return: the heavy modules it imported
+    """
+    script = "import sys\nARGV = {!r}\n{}\nimport json\nprint(json.dumps([x for x in {!r} if x in sys.modules]))"
+    result = subprocess.run([sys.executable, "-c", script.format(list(argv), code, heavy)], cwd=ROOT,
+                            capture_output=True, text=True, check=True)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def test_help_does_not_import_heavy_modules():
+    assert imported(HELP, ["--help"]) == []
+
+
+def test_argument_error_does_not_import_heavy_modules():
+    # -f is required, so argparse stops with an error
+    assert imported(HELP, ["-i", "."]) == []
+
+
+def test_writers_does_not_import_heavy_modules():
+    writers = [x._get_name() for x in outtu.out_functions if x._get_name() != "Parquet"]
+    assert imported(WRITERS, writers) == []
+
+
+def test_parquet_does_not_import_camelot():
+    # pyarrow imports pandas by itself when it is installed, to tell if the values it is given are from pandas
+    assert imported(WRITERS, ["Parquet"], ["camelot"]) == []
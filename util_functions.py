@@ -1,12 +1,17 @@
+import re
+
+import numparse
+
 
 def get_float(s: str) -> float:
     """
     Get a float from a string.
-    :param s: The string to convert to a float.
-    :return: The float.
+    Use numparse.parse instead to get an error, when the string is not a number.
+    :param s: The danish formatted number to convert to a float.
+    :return: The float, or 0.0 if it is empty or not a number.
     """
     try:
-        return float(s.replace(".", "").replace(",", "."))
+        return numparse.parse(s) or 0.0
     except ValueError:
         return 0.0
 
@@ -32,3 +37,20 @@ def get_month(t):
         "december": 12
     }[t]
 
+
+
+def find_month(text: str):
+    """
+    Find the pay period in the text of a payslip, either as a period of dates or the name of the month and year
+    eg. "Lønperiode 01.01.2020 - 31.01.2020" or "Januar 2020"
+    :param text: text from the payslip or its metadata
+    :return: the month formatted as YYYY-MM, or None if it was not found
+    """
+    matches = re.search(r"periode\D{0,10}(\d{1,2})[.\-/](\d{1,2})[.\-/](\d{4})", text, re.IGNORECASE)
+    if matches and 1 <= int(matches.group(2)) <= 12:
+        return matches.group(3) + "-" + matches.group(2).zfill(2)
+    matches = re.search(r"\b(januar|februar|marts|april|maj|juni|juli|august|september|oktober|november|december)"
+                        r"\s+(\d{4})\b", text, re.IGNORECASE)
+    if matches:
+        return matches.group(2) + "-" + str(get_month(matches.group(1).lower())).zfill(2)
+    return None
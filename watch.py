@@ -0,0 +1,206 @@
+import ctypes
+import ctypes.util
+import logging
+import os
+import pathlib
+import select
+import struct
+import time
+from abc import ABC
+
+logger = logging.getLogger(__name__)
+
+
+class WatcherBase(ABC):
+    """
+    Tells which pdfs in a directory has been added, changed or removed since it was last asked
+    """
+    name = None
+
+    def __init__(self, directory: pathlib.Path, recursive: bool = False, interval: float = 2.0):
+        """
+        :param directory: the directory to watch
+        :param recursive: also watch the folders in the directory, like --batch
+        :param interval: how often to look for changes, for the watchers that has to look
+        """
+        self.name = self._get_name()
+        self.directory = pathlib.Path(directory)
+        self.recursive = recursive
+        self.interval = interval
+
+    def changes(self, timeout: float = None) -> set:
+        """
+        Wait for pdfs to change
+        :param timeout: seconds to wait, or None to wait until something changes
+        :return: the pdfs that changed, empty if nothing changed before the timeout
+        """
+        raise NotImplementedError("This needs to be implemented.")
+
+    def close(self):
+        pass
+
+    def __str__(self):
+        return self._get_name()
+
+    @staticmethod
+    def _get_name():
+        raise NotImplementedError("This needs to be implemented.")
+
+
+def _is_pdf(path: pathlib.Path) -> bool:
+    return path.name.lower().endswith("pdf")
+
+
+class Inotify(WatcherBase):
+    """
+    Gets told by the kernel when a file is written or moved in to the directory, through inotify from libc.
+    Only works on Linux, and not on most network drives
+    """
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_FROM = 0x00000040
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+    IN_Q_OVERFLOW = 0x00004000
+    IN_ISDIR = 0x40000000
+    MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+    # wd, mask, cookie and the length of the name
+    EVENT = struct.Struct("iIII")
+
+    def __init__(self, directory: pathlib.Path, recursive: bool = False, interval: float = 2.0):
+        super().__init__(directory, recursive, interval)
+        self.libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        if not hasattr(self.libc, "inotify_init1"):
+            raise OSError("inotify is not supported here")
+        self.fd = self.libc.inotify_init1(os.O_CLOEXEC | os.O_NONBLOCK)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        # watch descriptor to the directory it watches
+        self.watches = {}
+        self._add(self.directory)
+        if recursive:
+            for path in self.directory.rglob("*"):
+                if path.is_dir():
+                    self._add(path)
+
+    def _add(self, directory: pathlib.Path):
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(directory), self.MASK)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), "Could not watch {}".format(directory))
+        self.watches[wd] = directory
+
+    def _read(self) -> set:
+        changed = set()
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return changed
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = self.EVENT.unpack_from(data, offset)
+            offset += self.EVENT.size
+            name = os.fsdecode(data[offset:offset + length].rstrip(b"\0"))
+            offset += length
+            if mask & self.IN_Q_OVERFLOW:
+                # Too many events at once, so every pdf could have changed
+                logger.warning("Missed some changes in %s, as there were too many at once", self.directory)
+                changed.update(x for x in self.directory.rglob("*") if _is_pdf(x))
+                continue
+            if wd not in self.watches:
+                continue
+            path = self.watches[wd] / name
+            if mask & self.IN_ISDIR:
+                if self.recursive and mask & (self.IN_CREATE | self.IN_MOVED_TO):
+                    # A new employee folder. Pdfs already in it when the watch is added are not seen by inotify
+                    self._add(path)
+                    changed.update(x for x in path.rglob("*") if _is_pdf(x))
+                continue
+            # A pdf being created is only interesting when it has been written and closed
+            if _is_pdf(path) and not mask & self.IN_CREATE:
+                changed.add(path)
+        return changed
+
+    def changes(self, timeout: float = None) -> set:
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return set()
+        return self._read()
+
+    def close(self):
+        os.close(self.fd)
+
+    @staticmethod
+    def _get_name():
+        return "inotify"
+
+
+class Polling(WatcherBase):
+    """
+    Looks at the modification time and size of every pdf each interval. Works everywhere, also on network drives
+    """
+
+    def __init__(self, directory: pathlib.Path, recursive: bool = False, interval: float = 2.0):
+        super().__init__(directory, recursive, interval)
+        self.seen = self._snapshot()
+
+    def _snapshot(self) -> dict:
+        snapshot = {}
+        for path in self.directory.rglob("*") if self.recursive else self.directory.glob("*"):
+            if _is_pdf(path):
+                try:
+                    stat = path.stat()
+                except FileNotFoundError:
+                    continue
+                snapshot[path] = (stat.st_mtime_ns, stat.st_size)
+        return snapshot
+
+    def changes(self, timeout: float = None) -> set:
+        end = None if timeout is None else time.monotonic() + timeout
+        while True:
+            time.sleep(self.interval if end is None else max(min(self.interval, end - time.monotonic()), 0))
+            snapshot = self._snapshot()
+            changed = {x for x in snapshot.keys() | self.seen.keys() if snapshot.get(x) != self.seen.get(x)}
+            self.seen = snapshot
+            if changed or (end is not None and time.monotonic() >= end):
+                return changed
+
+    @staticmethod
+    def _get_name():
+        return "polling"
+
+
+watchers: [WatcherBase] = [Inotify, Polling]
+
+
+def get_watcher(directory: pathlib.Path, recursive: bool = False, interval: float = 2.0,
+                name: str = None) -> WatcherBase:
+    """
+    :param name: the watcher to use, or None to use the first that works here
+    """
+    for watcher in watchers:
+        if name is not None and watcher._get_name() != name:
+            continue
+        try:
+            return watcher(directory, recursive, interval)
+        except OSError as e:
+            if name is not None:
+                raise
+            logger.warning("Could not use %s to watch %s (%s), trying the next", watcher._get_name(), directory, e)
+    raise Exception("Unknown watcher {}".format(name))
+
+
+def batches(watcher: WatcherBase, settle: float = 1.0):
+    """
+    Wait for pdfs to change, and then until nothing has changed for settle seconds,
+    so a folder of pdfs being copied is handled at once and not while a pdf is half written
+    :return: generator of the pdfs that changed in each batch
+    """
+    while True:
+        changed = watcher.changes()
+        while True:
+            more = watcher.changes(settle)
+            if not more:
+                break
+            changed |= more
+        if changed:
+            yield changed